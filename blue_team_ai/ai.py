@@ -4,37 +4,491 @@ blue_team_ai/ai.py — AI classification using DeepSeek via OpenRouter.
 
 This module sends a chat completion request to OpenRouter's DeepSeek model
 (deepseek/deepseek-chat). It expects the environment variable DEEPSEEK_API_KEY
-to be set (your OpenRouter key). If the key is missing or invalid, or if the
+to be set (your OpenRouter key); the client is only created (and openai only
+imported) on the first classification. If the key is missing or invalid, or if the
 response structure is unexpected, this will fall back to {"ai_label":"", "ai_score":0.0}.
+
+Both a blocking (classify_record) and an asyncio (classify_record_async) entry
+point are provided; the async one lets the CLI keep many requests in flight.
+classify_records_batch() submits a whole file as one Batch API job instead;
+OpenRouter has no Batch API, so this needs AI_BATCH_BASE_URL pointing at an
+OpenAI-compatible endpoint (with /files and /batches) that serves MODEL_NAME.
+
+Records with IOC hits or decisive keywords are labelled locally without an
+API call. Successful classifications are kept in an exact-match cache keyed
+on the model, the prompt version and the message, so repeated log lines cost
+one API call. The cache can be persisted to an explicit file across runs with
+load_cache() / save_cache().
 """
 
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import math
 import os
-import sys
-from typing import Dict, Any
+import re
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
 try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # optional speed-up; fall back to the stdlib json module
+    _json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+MODEL_NAME = "deepseek/deepseek-chat:free"  # Use ":free" suffix if you're on the free tier
+
+# OpenAI-compatible endpoint for Batch API jobs (OpenRouter has none); its key
+# is AI_BATCH_API_KEY, or DEEPSEEK_API_KEY if that is unset
+AI_BATCH_BASE_URL = os.environ.get("AI_BATCH_BASE_URL", "").strip()
+
+# Connection pool sizing and per-request timeout (seconds) for the API clients
+HTTP_MAX_CONNECTIONS = 50
+HTTP_TIMEOUT = 30.0
+
+# Completion budget: the compact JSON reply is ~12 tokens, and generation
+# stops at the first newline
+AI_MAX_TOKENS = 16
+
+# Retries for rate-limit (429), 5xx and connection errors; the OpenAI SDK
+# backs off exponentially with jitter between attempts
+AI_MAX_RETRIES = 5
+
+
+# Bump whenever SYSTEM_PROMPT, the user prompt or the reply parsing changes,
+# so cached classifications made under the old prompt are not reused
+PROMPT_VERSION = 1
+
+# Seconds between status checks of a submitted batch job
+BATCH_POLL_INTERVAL = 10.0
+
+# Fixed instructions sent as the system message of every request, so providers
+# with prompt caching can reuse the shared prefix across calls
+SYSTEM_PROMPT = (
+    "You are a cybersecurity expert. Analyze the log message you are given "
+    "and classify the threat level.\n\n"
+    "SCORING SYSTEM:\n"
+    "• malicious (-1): Confirmed threats, successful attacks\n"
+    "• anomalous (0): Suspicious activity, failed attempts, unusual patterns\n"
+    "• normal (1): Routine operations, successful logins, standard traffic\n\n"
+    "Consider: Failed logins, blocked connections = anomalous. "
+    "Regular operations = normal.\n\n"
+    "Respond with one line of compact JSON only: "
+    '{"label":"<malicious|anomalous|normal>","score":<confidence 0.0-1.0>}'
+)
+
+# Log messages are truncated to this many characters in the prompt
+PROMPT_MAX_MESSAGE_CHARS = 800
+_WS_RE = re.compile(r"\s+")
+
+# Fixed prefix of the per-record user prompt
+_PROMPT_LOG_PREFIX = "LOG MESSAGE: "
+
+# Label -> numeric threat level
+_THREAT_LEVELS = {
+    "malicious": -1,
+    "anomalous": 0,
+    "normal": 1
+}
+
+# Free-text reply from models without JSON mode, e.g. "Label: malicious, Confidence: 0.95"
+_RESPONSE_RE = re.compile(
+    r"Label:\s*(\w+)[,\s]+(?:Confidence|Score):\s*([0-9]*\.?[0-9]+)", re.IGNORECASE
+)
+
+# Keywords decisive enough to label a record without asking the model
+_ATTACK_KEYWORDS = re.compile(r"attack|exploit|malware|breach", re.IGNORECASE)
+_ANOMALY_KEYWORDS = re.compile(r"failed|blocked|denied|suspicious", re.IGNORECASE)
+
+# Exact-match cache: _cache_key(message) -> classification result
+_exact_cache: Dict[str, Dict[str, Any]] = {}
+_cache_dirty = False
+
+# Shared blocking client, built on first use by _get_client()
+_client = None
+_client_inited = False
+
+# Client for AI_BATCH_BASE_URL, built on first use by _get_batch_client()
+_batch_client = None
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` requests per `per` seconds, with bursts of
+    up to `rate` requests. Each caller reserves a token and is told how long
+    to wait for it, so concurrent callers are spaced out evenly.
+    """
+
+    def __init__(self, rate: float, per: float = 60.0):
+        if not rate > 0 or not per > 0:
+            raise ValueError(f"RateLimiter needs a positive rate and period, got {rate}/{per}s")
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.fill_rate
+
+    def acquire(self) -> None:
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _requests_per_minute(raw: Optional[str]) -> Optional[float]:
+    """
+    Parse the AI_REQUESTS_PER_MINUTE setting. Unset, empty or 0 means no
+    client-side cap; anything that is not a positive finite number is
+    logged and ignored rather than breaking the import.
+    """
+    if raw is None or not raw.strip():
+        return None
+    try:
+        rate = float(raw)
+    except ValueError:
+        rate = math.nan
+    if not math.isfinite(rate) or rate < 0:
+        logger.warning("Ignoring invalid AI_REQUESTS_PER_MINUTE=%r; requests are not rate-limited", raw)
+        return None
+    return rate or None
+
+
+# Optional client-side cap on request rate (requests per minute); off unless
+# AI_REQUESTS_PER_MINUTE is set, since the provider's 429s are retried anyway
+AI_REQUESTS_PER_MINUTE = _requests_per_minute(os.environ.get("AI_REQUESTS_PER_MINUTE"))
+_rate_limiter: Optional[RateLimiter] = (
+    RateLimiter(AI_REQUESTS_PER_MINUTE) if AI_REQUESTS_PER_MINUTE else None
+)
+
+
+def _http_limits():
+    """
+    Connection limits shared by the blocking and async httpx pools.
+    """
+    import httpx
+
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_CONNECTIONS
+    )
+
+
+def _get_client():
+    """
+    Return the shared OpenAI client for OpenRouter, creating it on first use
+    so that importing this module does not pull in openai/httpx. Returns None
+    (and reports why, once) if the key is missing or openai is unavailable.
+    """
+    global _client, _client_inited
+    if _client_inited:
+        return _client
+    _client_inited = True
+
+    try:
+        import httpx  # installed with openai
+        from openai import OpenAI
+
+        key = os.environ.get("DEEPSEEK_API_KEY", "").strip()
+        if not key:
+            raise ValueError("DEEPSEEK_API_KEY not set")
+
+        # One keep-alive connection pool for every request made by this process
+        http_client = httpx.Client(limits=_http_limits(), timeout=HTTP_TIMEOUT)
+        atexit.register(http_client.close)
+
+        _client = OpenAI(
+            api_key=key,
+            base_url=OPENROUTER_BASE_URL,
+            http_client=http_client,
+            max_retries=AI_MAX_RETRIES
+        )
+
+    except Exception as e:
+        logger.error("[OpenRouter Setup Error] %s", e)
+        _client = None
+
+    return _client
+
+
+def _get_batch_client():
+    """
+    Return the client for Batch API jobs, pointed at AI_BATCH_BASE_URL and
+    created on first use. Raises RuntimeError if AI_BATCH_BASE_URL is not
+    set, since OpenRouter itself has no /files or /batches endpoints.
+    """
+    global _batch_client
+    if _batch_client is not None:
+        return _batch_client
+    if not AI_BATCH_BASE_URL:
+        raise RuntimeError("AI_BATCH_BASE_URL not set (OpenRouter has no Batch API)")
+    client = _get_client()
+    if client is None:
+        raise RuntimeError("AI classification unavailable")
+    import httpx
     from openai import OpenAI
 
-    key = os.environ.get("DEEPSEEK_API_KEY", "").strip()
-    if not key:
-        raise ValueError("DEEPSEEK_API_KEY not set")
+    http_client = httpx.Client(limits=_http_limits(), timeout=HTTP_TIMEOUT)
+    atexit.register(http_client.close)
+    _batch_client = OpenAI(
+        api_key=os.environ.get("AI_BATCH_API_KEY", "").strip() or client.api_key,
+        base_url=AI_BATCH_BASE_URL,
+        http_client=http_client,
+        max_retries=AI_MAX_RETRIES
+    )
+    return _batch_client
+
+
+def new_async_client():
+    """
+    Build an AsyncOpenAI client pointed at OpenRouter, sharing the key of the
+    blocking client and backed by its own pooled httpx.AsyncClient.
+    Returns None when AI classification is unavailable. The caller owns the
+    client and should close it (which also closes the pool) when done.
+    """
+    client = _get_client()
+    if client is None:
+        return None
+    import httpx
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key=client.api_key,
+        base_url=OPENROUTER_BASE_URL,
+        http_client=httpx.AsyncClient(limits=_http_limits(), timeout=HTTP_TIMEOUT),
+        max_retries=AI_MAX_RETRIES
+    )
+
+
+def _cache_key(message: str) -> str:
+    """
+    Cache key for classifying `message` with the current model and prompt.
+    Only records without IOC hits reach the model, so the hits are not part
+    of the key.
+    """
+    raw = f"{MODEL_NAME}\0{PROMPT_VERSION}\0{message}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-    client = OpenAI(
-        api_key=key,
-        base_url="https://openrouter.ai/api/v1"
+
+def _cache_put(key: str, result: Dict[str, Any]) -> None:
+    global _cache_dirty
+    _exact_cache[key] = dict(result)
+    _cache_dirty = True
+
+
+def _valid_cached_result(key: Any, result: Any) -> bool:
+    """
+    Whether a persisted (key, result) pair has the shape of a cache entry:
+    a sha256 hex key and a result dict as built by _parse_response().
+    """
+    if not (isinstance(key, str) and len(key) == 64 and isinstance(result, dict)):
+        return False
+    score = result.get("ai_score")
+    return (
+        isinstance(result.get("ai_label"), str)
+        and (score is None or (isinstance(score, (int, float)) and not isinstance(score, bool)))
+        and result.get("threat_level") in (-1, 0, 1)
     )
-    model_name = "deepseek/deepseek-chat:free"  # Use ":free" suffix if you're on the free tier
 
-except Exception as e:
-    print(f"[OpenRouter Setup Error] {e}", file=sys.stderr)
-    client = None
-    model_name = None
+
+def load_cache(cache_path: Path) -> int:
+    """
+    Merge previously saved classifications from `cache_path` into the
+    in-memory cache. A missing or unreadable file is ignored and malformed
+    entries are skipped. Returns the number of entries loaded.
+    """
+    path = Path(cache_path)
+    try:
+        with path.open() as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        logger.error("AI cache load error (%s): %s", path, e)
+        return 0
+    if not isinstance(entries, dict):
+        logger.error("AI cache load error (%s): expected a JSON object", path)
+        return 0
+    loaded = 0
+    for key, result in entries.items():
+        if _valid_cached_result(key, result):
+            _exact_cache.setdefault(key, result)
+            loaded += 1
+    if loaded < len(entries):
+        logger.warning("Skipped %d malformed AI cache entries in %s", len(entries) - loaded, path)
+    return loaded
+
+
+def save_cache(cache_path: Path) -> None:
+    """
+    Write the in-memory cache to `cache_path` if any new classification was
+    added since the last save.
+    """
+    global _cache_dirty
+    if not _cache_dirty:
+        return
+    path = Path(cache_path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(_exact_cache, f)
+        tmp_path.replace(path)
+        _cache_dirty = False
+    except Exception as e:
+        logger.error("AI cache save error (%s): %s", path, e)
+
+
+def _build_prompt(message: str) -> str:
+    """
+    Build the per-record user prompt from the log message. The fixed
+    instructions live in SYSTEM_PROMPT; records with IOC hits are labelled
+    locally (see _keyword_result) and never reach the model. The message is
+    cut to PROMPT_MAX_MESSAGE_CHARS and its whitespace runs collapsed.
+    """
+    # Oversized lines only add prompt tokens; the signal is in the first part
+    return _PROMPT_LOG_PREFIX + _WS_RE.sub(" ", message[:PROMPT_MAX_MESSAGE_CHARS]).strip()
+
+
+def _request_params(message: str) -> Dict[str, Any]:
+    """
+    Chat-completion request parameters for classifying one message.
+    """
+    return {
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": _build_prompt(message)},
+        ],
+        "max_tokens": AI_MAX_TOKENS,
+        "stop": ["\n"],
+        "temperature": 0.0,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def _as_score(value: Any) -> Optional[float]:
+    """
+    The model's confidence as a float, or None when it is missing or not a
+    finite number (e.g. null or "high").
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return None
+    return score if math.isfinite(score) else None
+
+
+def _parse_response(content: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the model reply into a result dict. Expects the JSON object asked
+    for in SYSTEM_PROMPT ({"label": ..., "score": ...}) and accepts the older
+    "Label: malicious, Confidence: 0.95" text form from models that ignore
+    JSON mode. A JSON reply whose score is missing or not numeric gets
+    ai_score None. Returns None if the reply matches neither form.
+    """
+    if not isinstance(content, str):
+        return None
+    try:
+        obj = _json_loads(content)
+    except ValueError:
+        obj = None
+
+    if isinstance(obj, dict) and isinstance(obj.get("label"), str):
+        ai_label = obj["label"].lower()
+        ai_score = _as_score(obj.get("score"))
+    else:
+        m = _RESPONSE_RE.search(content)
+        if m is None:
+            return None
+        ai_label = m.group(1).lower()
+        ai_score = float(m.group(2))
+
+    return {
+        "ai_label": ai_label,
+        "ai_score": ai_score,
+        "threat_level": _THREAT_LEVELS.get(ai_label, 0)
+    }
+
+
+def _keyword_result(message: str, ioc_hits: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    """
+    Rule-based label for records that need no AI call: any IOC match is
+    malicious, attack keywords are malicious, failure keywords are anomalous.
+    Returns None when the record is ambiguous and should go to the model.
+    """
+    if ioc_hits:
+        return {"ai_label": "malicious", "ai_score": 0.8, "threat_level": -1}
+    if _ATTACK_KEYWORDS.search(message):
+        return {"ai_label": "malicious", "ai_score": 0.7, "threat_level": -1}
+    if _ANOMALY_KEYWORDS.search(message):
+        return {"ai_label": "anomalous", "ai_score": 0.6, "threat_level": 0}
+    return None
+
+
+def _fallback_result(message: str, ioc_hits: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Basic keyword-based classification used when the AI call fails.
+    """
+    result = _keyword_result(message, ioc_hits)
+    if result is None:
+        result = {"ai_label": "normal", "ai_score": 0.5, "threat_level": 1}
+    logger.debug("Returning keyword fallback result: %s", result)
+    return result
+
+
+def _blank_result() -> Dict[str, Any]:
+    """
+    The "no classification" result.
+    """
+    return {"ai_label": "", "ai_score": 0.0, "threat_level": 0}
+
+
+def _local_result(
+    message: str, ioc_hits: List[Dict[str, str]]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Shared first step of every classification path: returns (result, key)
+    where result is set when no API call is needed (blank for an empty
+    message, the IOC/keyword label, or a cached classification) and key is
+    the cache key for the API result otherwise.
+    """
+    if not message:
+        return _blank_result(), None
+
+    # IOC hits and decisive keywords are labelled without an API call
+    result = _keyword_result(message, ioc_hits)
+    if result is not None:
+        return result, None
+
+    key = _cache_key(message)
+    cached = _exact_cache.get(key)
+    if cached is not None:
+        return dict(cached), key
+    return None, key
 
 
 def classify_record(record: Dict[str, Any]) -> Dict[str, Any]:
     """
     Classify a log record's 'message' using DeepSeek (via OpenRouter).
-    Now includes IOC context for accurate AI scoring.
+    Records with IOC hits are labelled malicious without an API call.
     Returns a dict with keys:
       - 'ai_label': the predicted label (e.g., 'malicious', 'anomalous', or 'normal')
       - 'ai_score': the confidence score (float)
@@ -45,89 +499,170 @@ def classify_record(record: Dict[str, Any]) -> Dict[str, Any]:
     """
     message = record.get("message", "")
     ioc_hits = record.get("ioc_hits", [])
-    src_ip = record.get("src_ip", "")
-    
-    # Define threat levels mapping
-    threat_levels = {
-        "malicious": -1,
-        "anomalous": 0, 
-        "normal": 1
-    }
-    
-    if not message or client is None:
-        return {"ai_label": "", "ai_score": 0.0, "threat_level": 0}
+
+    result, key = _local_result(message, ioc_hits)
+    if result is not None:
+        return result
+
+    client = _get_client()
+    if client is None:
+        return _blank_result()
 
     try:
-        # Build context about IOC hits
-        ioc_context = ""
-        if ioc_hits:
-            ioc_details = []
-            for hit in ioc_hits:
-                ioc_details.append(f"- {hit['ioc']} ({hit['type']}): {hit['description']}")
-            ioc_context = f"\n\nTHREAT INTELLIGENCE MATCHES:\n" + "\n".join(ioc_details)
-        
-        prompt = (
-            "You are a cybersecurity expert. Analyze this log and classify the threat level.\n\n"
-            "SCORING SYSTEM:\n"
-            "• malicious (-1): Confirmed threats, IOC matches, successful attacks\n"  
-            "• anomalous (0): Suspicious activity, failed attempts, unusual patterns\n"
-            "• normal (1): Routine operations, successful logins, standard traffic\n\n"
-            f"LOG MESSAGE: {message}"
-            f"{ioc_context}\n\n"
-            "Consider: If there are IOC matches, this is definitely malicious. "
-            "Failed logins, blocked connections = anomalous. "
-            "Regular operations = normal.\n\n"
-            "Response format: Label: <malicious|anomalous|normal>, Confidence: <0.0-1.0>"
-        )
+        if _rate_limiter is not None:
+            _rate_limiter.acquire()
+        response = client.chat.completions.create(**_request_params(message))
+
+        result = _parse_response(response.choices[0].message.content)
+        if result is not None:
+            _cache_put(key, result)
+            return result
 
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=25,
-            temperature=0.0
-        )
-        
-        content = response.choices[0].message.content.strip()
-
-        # Parse response: "Label: malicious, Confidence: 0.95"
-        if "Label:" in content and "Confidence:" in content:
-            parts = content.split(",")
-            label_part = parts[0].split("Label:")[1].strip()
-            score_part = parts[1].split("Confidence:")[1].strip()
-            
-            ai_label = label_part.lower()
-            ai_score = float(score_part)
-            threat_level = threat_levels.get(ai_label, 0)
-            
-            return {
-                "ai_label": ai_label,
-                "ai_score": ai_score,
-                "threat_level": threat_level
-            }
-            
     except Exception as e:
         # Handle rate limiting or other API errors
-        error_msg = str(e)
-        print(f"AI classification error: {error_msg}", file=sys.stderr)
-        
+        logger.warning("AI classification error: %s", e)
+
         # Fallback: basic keyword-based classification when AI is unavailable
-        if ioc_hits:
-            result = {"ai_label": "malicious", "ai_score": 0.8, "threat_level": -1}
-            print(f"DEBUG: Returning result with IOC fallback: {result}", file=sys.stderr)
-            return result
-        elif any(word in message.lower() for word in ["attack", "exploit", "malware", "breach"]):
-            result = {"ai_label": "malicious", "ai_score": 0.7, "threat_level": -1}
-            print(f"DEBUG: Returning result with attack keywords: {result}", file=sys.stderr)
-            return result
-        elif any(word in message.lower() for word in ["failed", "blocked", "denied", "suspicious"]):
-            result = {"ai_label": "anomalous", "ai_score": 0.6, "threat_level": 0}
-            print(f"DEBUG: Returning result with anomaly keywords: {result}", file=sys.stderr)
+        return _fallback_result(message, ioc_hits)
+
+    result = _blank_result()
+    logger.debug("Returning final fallback result: %s", result)
+    return result
+
+
+async def classify_record_async(record: Dict[str, Any], client=None) -> Dict[str, Any]:
+    """
+    Async counterpart of classify_record() that awaits the completion on an
+    AsyncOpenAI `client` (see new_async_client()), so many records can be
+    classified concurrently. Returns the same dict shape as classify_record().
+
+    Without an async client this defers to classify_record(), which handles
+    the "AI unavailable" case.
+    """
+    if client is None:
+        return classify_record(record)
+
+    message = record.get("message", "")
+    ioc_hits = record.get("ioc_hits", [])
+
+    result, key = _local_result(message, ioc_hits)
+    if result is not None:
+        return result
+
+    try:
+        if _rate_limiter is not None:
+            await _rate_limiter.acquire_async()
+        response = await client.chat.completions.create(**_request_params(message))
+
+        result = _parse_response(response.choices[0].message.content)
+        if result is not None:
+            _cache_put(key, result)
             return result
+
+    except Exception as e:
+        logger.warning("AI classification error: %s", e)
+        return _fallback_result(message, ioc_hits)
+
+    result = _blank_result()
+    logger.debug("Returning final fallback result: %s", result)
+    return result
+
+
+def classify_records_batch(
+    records: List[Dict[str, Any]],
+    poll_interval: float = BATCH_POLL_INTERVAL
+) -> List[Dict[str, Any]]:
+    """
+    Classify many records with a single OpenAI-compatible Batch API job
+    instead of one request per record: the prompts are uploaded as a JSONL
+    file, the job is polled every `poll_interval` seconds until it finishes,
+    and the output file is mapped back to the records via custom_id.
+
+    Returns one result dict (same shape as classify_record()) per record, in
+    order. Empty messages, keyword-decided records, cache hits and a missing
+    client never reach the API. The job goes to AI_BATCH_BASE_URL (see
+    _get_batch_client()). Raises RuntimeError if that is not configured or
+    the batch job does not complete.
+    """
+    results: List[Dict[str, Any]] = [{} for _ in records]
+    pending: Dict[str, tuple] = {}      # custom_id -> (indices, message, ioc_hits, key)
+    custom_ids: Dict[str, str] = {}     # cache key -> custom_id, to submit duplicates once
+    request_lines: List[str] = []
+    client = _get_client()
+
+    for i, record in enumerate(records):
+        message = record.get("message", "")
+        ioc_hits = record.get("ioc_hits", [])
+        result, key = _local_result(message, ioc_hits)
+        if result is not None:
+            results[i] = result
+            continue
+        if client is None:
+            results[i] = _blank_result()
+            continue
+
+        if key in custom_ids:
+            pending[custom_ids[key]][0].append(i)
+            continue
+        custom_id = custom_ids[key] = str(i)
+        pending[custom_id] = ([i], message, ioc_hits, key)
+        request_lines.append(json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _request_params(message),
+        }))
+
+    if not pending:
+        return results
+
+    client = _get_batch_client()
+    batch_file = client.files.create(
+        file=("blue_team_ai_batch.jsonl", "\n".join(request_lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+    output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        row = _json_loads(line)
+        entry = pending.get(row.get("custom_id"))
+        if entry is None:
+            continue
+        indices, message, ioc_hits, key = entry
+        try:
+            content = row["response"]["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            # Errored request: leave it pending for the keyword fallback below
+            continue
+        del pending[row["custom_id"]]
+        try:
+            result = _parse_response(content)
+        except Exception:
+            result = None
+        if result is None:
+            result = _blank_result()
         else:
-            result = {"ai_label": "normal", "ai_score": 0.5, "threat_level": 1}
-            print(f"DEBUG: Returning result with normal fallback: {result}", file=sys.stderr)
-            return result
-    
-    result = {"ai_label": "", "ai_score": 0.0, "threat_level": 0}
-    print(f"DEBUG: Returning final fallback result: {result}", file=sys.stderr)
-    return result
\ No newline at end of file
+            _cache_put(key, result)
+        for i in indices:
+            results[i] = dict(result)
+
+    # Requests that failed inside the batch get the keyword fallback
+    for indices, message, ioc_hits, _ in pending.values():
+        result = _fallback_result(message, ioc_hits)
+        for i in indices:
+            results[i] = dict(result)
+
+    return results
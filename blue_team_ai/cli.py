@@ -6,17 +6,21 @@ Note: On successful completion, this script calls sys.exit(0) so that
 pytest tests expecting a SystemExit pass cleanly.
 """
 import argparse
-import json
+import asyncio
 import logging
+import mmap
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator, Optional
 
 # 1) Parsing logic
 from blue_team_ai.parsers.parse_logs import parse_syslog
 
 # 2) Enrichment: IOC + free‐API GeoIP (rely on module reference for lookup_geoip)
 import blue_team_ai.enrichment as enrichment_module
-from blue_team_ai.enrichment import load_ioc_list, enrich_all, extract_ip
+from blue_team_ai.enrichment import IocIndex, build_ioc_index, load_ioc_list, iter_enriched, extract_ip
 
 # 3) Rules engine (optional)
 from blue_team_ai.rules import apply_rules
@@ -24,6 +28,16 @@ from blue_team_ai.rules import apply_rules
 # 4) AI classification (DeepSeek)
 import blue_team_ai.ai as ai_module
 
+# 5) JSON output
+from blue_team_ai.output import dumps, stdout_writer
+
+# Files with at least this many lines are parsed in a process pool
+PARALLEL_PARSE_MIN_LINES = 10_000
+PARSE_CHUNKSIZE = 2048
+
+# Maximum number of AI requests kept in flight at once (OpenRouter rate limits)
+AI_CONCURRENCY = 20
+
 def setup_logging(verbose: bool):
     """
     Configure root logger. DEBUG level if verbose, else INFO.
@@ -35,83 +49,240 @@ def setup_logging(verbose: bool):
 
 def load_file(file_path: Path) -> list[str]:
     """
-    Read non-empty lines from the syslog file. Exit on errors.
+    Read non-empty lines from the syslog file (memory-mapped, decoded in one
+    go). Exit on errors.
     """
     if not file_path.exists():
         logging.error("Input file does not exist: %s", file_path)
         sys.exit(1)
     try:
-        with file_path.open() as f:
-            lines = [line.strip() for line in f if line.strip()]
-        return lines
+        with file_path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = mm.read().decode("utf-8")
+        # Split on "\n" only: splitlines() would also break on \x0b, \x0c,
+        # \x1c-\x1e, \x85, \u2028 and \u2029 inside messages. strip() drops
+        # any "\r"; filter(None, ...) drops the blank lines in C.
+        return list(filter(None, map(str.strip, text.split("\n"))))
     except Exception as e:
         logging.error("Failed reading file %s: %s", file_path, e)
         sys.exit(1)
 
+def _parse_line(line: str) -> Optional[dict]:
+    """
+    parse_syslog() wrapper that logs and drops unparseable lines.
+    Module-level so it can be shipped to worker processes.
+    """
+    try:
+        return parse_syslog(line)
+    except Exception as e:
+        logging.warning("Parse error on line '%s': %s", line[:50], e)
+        return None
+
+# IocIndex handed to each parse-pool worker by _init_parse_worker
+_worker_ioc_index: Optional[IocIndex] = None
+
+def _init_parse_worker(ioc_index: Optional[IocIndex]):
+    global _worker_ioc_index
+    _worker_ioc_index = ioc_index
+
+def _parse_chunk(lines: list[str]) -> list[dict]:
+    """
+    Pool task: parse one chunk of lines and, if the worker was given an
+    IOC index, IOC-enrich the records in the same pass.
+    """
+    records = filter(None, map(_parse_line, lines))
+    if _worker_ioc_index is not None:
+        records = iter_enriched(records, _worker_ioc_index, inplace=True)
+    return list(records)
+
+def parse_lines(lines: list[str], ioc_index: Optional[IocIndex] = None) -> Iterator[dict]:
+    """
+    Lazily parse syslog lines, dropping malformed ones, and IOC-enrich the
+    records when `ioc_index` is given. Inputs of at least
+    PARALLEL_PARSE_MIN_LINES lines are spread over a process pool (one
+    worker per CPU) in chunks of PARSE_CHUNKSIZE lines, enrichment included,
+    so records cross the process boundary once; smaller ones are handled
+    in-process to avoid the start-up cost.
+    """
+    if len(lines) >= PARALLEL_PARSE_MIN_LINES:
+        try:
+            ex = ProcessPoolExecutor(initializer=_init_parse_worker, initargs=(ioc_index,))
+        except OSError as e:
+            logging.debug("Process pool unavailable (%s); parsing in-process", e)
+        else:
+            chunks = (lines[i:i + PARSE_CHUNKSIZE] for i in range(0, len(lines), PARSE_CHUNKSIZE))
+            with ex:
+                for records in ex.map(_parse_chunk, chunks):
+                    yield from records
+            return
+    records = filter(None, map(_parse_line, lines))
+    if ioc_index is not None:
+        records = iter_enriched(records, ioc_index, inplace=True)
+    yield from records
+
+def attach_geoip(records: Iterable[dict], batch: bool = False) -> Iterator[dict]:
+    """
+    Lazily attach 'geoip' to every record (empty lookup if it has no IP).
+    Each distinct IP is looked up once per run, concurrently and ahead of
+    the records (through ip-api.com's batch endpoint with `batch`).
+    """
+    geoip_cache: dict = {}
+    records = enrichment_module.iter_geoip_prefetched(records, geoip_cache, batch=batch)
+    for r in records:
+        src_ip = r.get("src_ip")
+        if not src_ip:
+            src_ip = extract_ip(r) or ""
+        # IMPORTANT: goes through enrichment_module.lookup_geoip so pytest monkeypatch works
+        r["geoip"] = enrichment_module.lookup_geoip_cached(src_ip or "", geoip_cache)
+        yield r
+
 def process_records(
     lines: list[str],
     do_enrich: bool,
     ioc_file: Path,
     geoip_enabled: bool,
     do_rules: bool,
-    do_ai: bool
-) -> list[dict]:
+    do_ai: bool,
+    ai_cache_file: Optional[Path] = None,
+    ai_batch: bool = False,
+    geoip_batch: bool = False
+) -> Iterable[dict]:
     """
-    1. Parse lines → list of dicts
-    2. If do_enrich: attach IOC tags (enrich_all with geoip_enabled=False)
+    1. Parse lines → stream of dicts
+    2. If do_enrich: attach IOC tags (iter_enriched with geoip_enabled=False,
+       run inside the parse pool for large inputs)
     3. If geoip_enabled: for every record, attach geoip = enrichment_module.lookup_geoip(src_ip or "")
+       (IPs resolved 100 at a time through the batch endpoint when geoip_batch=True)
     4. If do_rules: run apply_rules(parsed) to produce alert list
-    5. If do_ai: classify each final record via ai_module.classify_record
-    """
-    # 1) Parse each line
-    parsed: list[dict] = []
-    for line in lines:
-        try:
-            rec = parse_syslog(line)
-            if rec:
-                parsed.append(rec)
-        except Exception as e:
-            logging.warning("Parse error on line '%s': %s", line[:50], e)
+    5. If do_ai: classify the final records concurrently via classify_records(),
+       reusing classifications persisted in `ai_cache_file` (if given) across runs
+       (or as one Batch API job when ai_batch=True); records with an empty
+       or whitespace-only message are labelled blank without being sent
 
-    # 2) IOC enrichment only (no geoip)
+    Stages 1-3 are chained generators, so without rules or AI each record
+    flows straight through to the output writer; rules consume the stream
+    in one pass keeping only alerts, and AI materializes its input as a list.
+    """
+    # 1+2) Parse each line, with IOC enrichment only (no geoip)
+    ioc_index = None
     if do_enrich:
         try:
-            iocs = load_ioc_list(str(ioc_file))
+            ioc_index = build_ioc_index(load_ioc_list(str(ioc_file)))
         except Exception as e:
             logging.error("Could not load IOC list: %s", e)
             sys.exit(1)
-        parsed = enrich_all(parsed, iocs, geoip_enabled=False)
+    parsed: Iterable[dict] = parse_lines(lines, ioc_index)
 
     # 3) Free‐API GeoIP enrichment for EVERY record
     if geoip_enabled:
-        for r in parsed:
-            src_ip = r.get("src_ip")
-            if not src_ip:
-                src_ip = extract_ip(r) or ""
-            # IMPORTANT: Call through the module so pytest monkeypatch works
-            r["geoip"] = enrichment_module.lookup_geoip(src_ip or "")
+        parsed = attach_geoip(parsed, batch=geoip_batch)
 
     # 4) Rule‐based alerting
     if do_rules:
-        output_list = apply_rules(parsed)
+        output_records = apply_rules(parsed)
     else:
-        output_list = parsed
+        output_records = parsed
 
-# 5) AI classification
+    # 5) AI classification (concurrent requests)
     if do_ai:
-        for r in output_list:
-            try:
-                ai_result = ai_module.classify_record(r)
-                r["ai_label"] = ai_result.get("ai_label", "")
-                r["ai_score"] = ai_result.get("ai_score", 0.0)
-                r["threat_level"] = ai_result.get("threat_level", 0) 
-            except Exception as e:
-                r["ai_label"] = "error"
+        output_records = list(output_records)
+        # Records with nothing to classify get the blank result up front
+        to_classify = []
+        for r in output_records:
+            if (r.get("message") or "").strip():
+                to_classify.append(r)
+            else:
+                r["ai_label"] = ""
                 r["ai_score"] = 0.0
-                r["threat_level"] = 0  
-                logging.debug("AI classification failed: %s", e)
+                r["threat_level"] = 0
+        if ai_cache_file is not None:
+            ai_module.load_cache(ai_cache_file)
+        if ai_batch:
+            classify_records_batch(to_classify)
+        else:
+            asyncio.run(classify_records(to_classify))
+        if ai_cache_file is not None:
+            ai_module.save_cache(ai_cache_file)
+
+    return output_records
+
+async def classify_records(records: list[dict], concurrency: int = AI_CONCURRENCY):
+    """
+    Classify every record via ai_module.classify_record_async, keeping at most
+    `concurrency` requests in flight over one shared AsyncOpenAI client.
+    Each record is updated in place with ai_label / ai_score / threat_level.
+    """
+    client = ai_module.new_async_client()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def classify_one(r: dict) -> dict:
+        async with sem:
+            return await ai_module.classify_record_async(r, client)
 
-    return output_list
+    try:
+        results = await asyncio.gather(
+            *(classify_one(r) for r in records), return_exceptions=True
+        )
+    finally:
+        if client is not None:
+            await client.close()
+
+    for r, ai_result in zip(records, results):
+        apply_ai_result(r, ai_result)
+
+def classify_records_batch(records: list[dict]):
+    """
+    Classify every record with one Batch API job (ai_module.classify_records_batch).
+    If the batch cannot be submitted or does not complete, fall back to
+    concurrent per-record requests. Records are updated in place.
+    """
+    try:
+        results = ai_module.classify_records_batch(records)
+    except Exception as e:
+        logging.warning("Batch AI classification failed (%s); using per-record requests", e)
+        asyncio.run(classify_records(records))
+        return
+    for r, ai_result in zip(records, results):
+        apply_ai_result(r, ai_result)
+
+def apply_ai_result(r: dict, ai_result):
+    """
+    Copy an AI result (or the exception raised while computing it) onto `r`.
+    """
+    if isinstance(ai_result, Exception):
+        r["ai_label"] = "error"
+        r["ai_score"] = 0.0
+        r["threat_level"] = 0
+        logging.debug("AI classification failed: %s", ai_result)
+        return
+    r["ai_label"] = ai_result.get("ai_label", "")
+    r["ai_score"] = ai_result.get("ai_score", 0.0)
+    r["threat_level"] = ai_result.get("threat_level", 0)
+
+def write_summary(write, total_lines: int, records: Iterable[dict], rules_applied: bool) -> int:
+    """
+    Stream the output document to `write` (a callable taking bytes) one
+    record at a time, so neither the records nor the encoded document need
+    to be held in memory:
+      {"total_lines": N, "records": [...], "parsed_records": P, "output_records": M}
+    The counts follow the records since a record stream is only counted once
+    it has been written. Returns the number of records written.
+    """
+    write(b'{"total_lines":' + dumps(total_lines) + b',"records":[')
+    count = 0
+    for rec in records:
+        write(b",\n" if count else b"\n")
+        write(dumps(rec))
+        count += 1
+    write(b"\n]," if count else b"],")
+    trailer = {
+        "parsed_records": None if rules_applied else count,
+        "output_records": count,
+    }
+    write(dumps(trailer)[1:] + b"\n")
+    return count
 
 def main():
     parser = argparse.ArgumentParser(
@@ -133,6 +304,10 @@ def main():
         "--geoip", action="store_true",
         help="Enable free‐API GeoIP lookup (via ip-api.com)"
     )
+    parser.add_argument(
+        "--geoip-batch", action="store_true",
+        help="Resolve GeoIP through ip-api.com's batch endpoint (100 IPs per request; requires --geoip)"
+    )
     parser.add_argument(
         "--ioc-file", type=Path,
         default=Path(__file__).parent / "data" / "iocs.csv",
@@ -146,11 +321,24 @@ def main():
         "--ai", action="store_true",
         help="Enable DeepSeek AI classification"
     )
+    parser.add_argument(
+        "--ai-batch", action="store_true",
+        help="Submit AI classification as one Batch API job to AI_BATCH_BASE_URL "
+             "(cheaper, but not interactive; requires --ai)"
+    )
+    parser.add_argument(
+        "--ai-cache", type=Path, default=None,
+        help="JSON file caching AI classifications across runs (not persisted unless given)"
+    )
     parser.add_argument(
         "--verbose", "-v", action="store_true",
         help="Enable verbose (DEBUG) logging"
     )
     args = parser.parse_args()
+    if args.ai_batch and not args.ai:
+        parser.error("--ai-batch requires --ai")
+    if args.geoip_batch and not args.geoip:
+        parser.error("--geoip-batch requires --geoip")
 
     setup_logging(args.verbose)
 
@@ -165,37 +353,30 @@ def main():
         geoip_enabled=args.geoip,
         do_rules=args.rules,
         do_ai=args.ai,
+        ai_cache_file=args.ai_cache,
+        ai_batch=args.ai_batch,
+        geoip_batch=args.geoip_batch,
     )
 
-    # 3) Build output summary
-    summary = {
-        "total_lines": len(lines),
-        "parsed_records": None if args.rules else len(output_records),
-        "output_records": len(output_records),
-        "records": output_records
-    }
-
-    # 4) Serialize to JSON
-    try:
-        out_json = json.dumps(summary, default=str, indent=2)
-    except Exception as e:
-        logging.error("Failed to serialize output JSON: %s", e)
-        sys.exit(1)
-
-    # 5) Write or print
+    # 3) Stream the summary JSON, one record per line
     if args.output:
         try:
             args.output.parent.mkdir(parents=True, exist_ok=True)
-            with args.output.open("w") as f:
-                f.write(out_json)
+            with args.output.open("wb") as f:
+                write_summary(f.write, len(lines), output_records, args.rules)
             logging.info("Output written to %s", args.output)
         except Exception as e:
             logging.error("Failed writing output file: %s", e)
             sys.exit(1)
     else:
-        print(out_json)
+        try:
+            write_summary(stdout_writer(), len(lines), output_records, args.rules)
+            sys.stdout.flush()
+        except Exception as e:
+            logging.error("Failed to serialize output JSON: %s", e)
+            sys.exit(1)
 
-    # 6) Explicitly exit with code 0 so pytest can catch SystemExit
+    # 4) Explicitly exit with code 0 so pytest can catch SystemExit
     sys.exit(0)
 
 if __name__ == "__main__":
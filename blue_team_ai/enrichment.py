@@ -8,42 +8,80 @@ Now, if geoip_enabled=True, every record receives a 'geoip' key:
 """
 import csv
 import re
+import sys
+from dataclasses import dataclass
+from concurrent.futures import Executor, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
 import requests
 
-# Regular expression to extract IPv4 addresses
-IP_REGEX = re.compile(r"(?P<ip>\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b)")
+try:
+    import ahocorasick
+except ImportError:  # optional: every extractor is run on every message instead
+    ahocorasick = None
 
-# Regular expressions for different IOC types
-DOMAIN_REGEX = re.compile(r'\b[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*\.[a-zA-Z]{2,}\b')
-URL_REGEX = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+')
-MD5_REGEX = re.compile(r'\b[a-fA-F0-9]{32}\b')
-SHA1_REGEX = re.compile(r'\b[a-fA-F0-9]{40}\b')
-SHA256_REGEX = re.compile(r'\b[a-fA-F0-9]{64}\b')
+# Regular expression to extract IPv4 addresses (octet group unrolled and
+# ASCII-only: about 3x faster per search than the repeated group)
+IP_REGEX = re.compile(r"(?P<ip>\b[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\b)", re.ASCII)
+
+# Regular expressions for different IOC types. IOCs are ASCII, so the \b
+# patterns are ASCII-only (faster; a match may now touch a non-ASCII letter).
+# URL_REGEX keeps Unicode \s so a URL still ends at an NBSP or U+3000.
+DOMAIN_REGEX = re.compile(r'\b[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*\.[a-zA-Z]{2,}\b', re.ASCII)
+URL_REGEX = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+', re.IGNORECASE)
+MD5_REGEX = re.compile(r'\b[a-fA-F0-9]{32}\b', re.ASCII)
+SHA1_REGEX = re.compile(r'\b[a-fA-F0-9]{40}\b', re.ASCII)
+SHA256_REGEX = re.compile(r'\b[a-fA-F0-9]{64}\b', re.ASCII)
+# Any of the above in one pass; extract_hashes keeps the 32/40/64 lengths
+HASH_REGEX = re.compile(r'\b[a-fA-F0-9]{32,64}\b', re.ASCII)
+_HASH_LENGTHS = frozenset((32, 40, 64))
 
 # Default path for IOCs CSV (relative to this file)
 IOC_CSV_DEFAULT = Path(__file__).parent / "data" / "iocs.csv"
 
+# ip-api.com batch endpoint: up to GEOIP_BATCH_SIZE IPs per POST
+GEOIP_BATCH_URL = "http://ip-api.com/batch"
+GEOIP_BATCH_SIZE = 100
+
+# GeoIP requests in flight at once, and records resolved ahead per window
+GEOIP_MAX_WORKERS = 20
+GEOIP_PREFETCH_WINDOW = 1000
+
+# Keep-alive connection pool for batch GeoIP requests
+_SESSION = requests.Session()
+
 def load_ioc_list(ioc_path: Optional[str] = None) -> List[Dict[str, str]]:
     """
     Load IOC list from a CSV file. CSV should have at least the columns:
       "ioc", "type", "description"
     Returns a list of dicts, each with keys 'ioc', 'type', and 'description'.
+    Types are lowercased; types and descriptions are interned since large
+    feeds repeat the same few values on every row.
     """
     csv_path = Path(ioc_path) if ioc_path else IOC_CSV_DEFAULT
     ioc_list: List[Dict[str, str]] = []
     try:
         with csv_path.open(newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            # Only load files that have the required columns
+            if not header or not {"ioc", "type", "description"} <= set(header):
+                return ioc_list
+            i_ioc = header.index("ioc")
+            i_type = header.index("type")
+            i_desc = header.index("description")
+            min_len = max(i_ioc, i_type, i_desc) + 1
             for row in reader:
-                # Only add rows that have the required columns
-                if "ioc" in row and "type" in row and "description" in row:
-                    ioc = row["ioc"].strip()
-                    itype = row["type"].strip()
-                    desc = row["description"].strip()
-                    if ioc:
-                        ioc_list.append({"ioc": ioc, "type": itype, "description": desc})
+                if len(row) < min_len:
+                    continue
+                ioc = row[i_ioc].strip()
+                if ioc:
+                    ioc_list.append({
+                        "ioc": ioc,
+                        "type": sys.intern(row[i_type].strip().lower()),
+                        "description": sys.intern(row[i_desc].strip()),
+                    })
     except FileNotFoundError:
         raise RuntimeError(f"IOC CSV file not found: {csv_path}")
     except Exception as e:
@@ -75,12 +113,24 @@ def extract_hashes(text: str) -> List[str]:
     """
     Extract all hash values (MD5, SHA1, SHA256) from the given text.
     """
-    hashes = []
-    hashes.extend(MD5_REGEX.findall(text))
-    hashes.extend(SHA1_REGEX.findall(text))
-    hashes.extend(SHA256_REGEX.findall(text))
+    hashes = [h for h in HASH_REGEX.findall(text) if len(h) in _HASH_LENGTHS]
+    # MD5s, then SHA1s, then SHA256s, each in text order
+    if len(hashes) > 1:
+        hashes.sort(key=len)
     return hashes
 
+# IOC types matched by extracting candidate tokens from the message text
+_EXTRACTORS = {
+    "domain": extract_domains,
+    "url": extract_urls,
+    "hash": extract_hashes,
+}
+_SCANNED_TYPES = tuple(_EXTRACTORS)
+
+# A substring every token of the type contains: one C-level "in" check
+# rules out the regex pass for most messages ("" = no cheap test)
+_REQUIRED_SUBSTRING = {"domain": ".", "url": "://", "hash": ""}
+
 def lookup_geoip(ip: str) -> Dict[str, str]:
     """
     Use the free ip-api.com service to return geo info for `ip`.
@@ -100,10 +150,198 @@ def lookup_geoip(ip: str) -> Dict[str, str]:
         pass
     return {}
 
+@dataclass
+class IocIndex:
+    """
+    An IOC list prepared for matching, built once per run by build_ioc_index:
+      - entries: the IOC dicts as loaded by load_ioc_list()
+      - by_type_lower: {"ip": {ioc.lower(): entry}, "domain": {...},
+        "url": {...}, "hash": {...}}
+      - automaton: Aho-Corasick automaton over all domain/url/hash IOCs when
+        pyahocorasick is installed (see _scan_types), else None
+      - scan_types: the domain/url/hash types that have any IOCs at all
+    """
+    entries: List[Dict[str, str]]
+    by_type_lower: Dict[str, Dict[str, Dict[str, str]]]
+    automaton: Any = None
+    scan_types: Tuple[str, ...] = _SCANNED_TYPES
+
+def build_ioc_index(ioc_list: List[Dict[str, str]]) -> IocIndex:
+    """
+    Index an IOC list by lowercased value per type for O(1) matching. Each
+    indexed entry is {'ioc','type','description'}; the first occurrence of
+    a duplicated IOC wins.
+    """
+    by_type_lower: Dict[str, Dict[str, Dict[str, str]]] = {
+        "ip": {}, "domain": {}, "url": {}, "hash": {}
+    }
+    for ioc_entry in ioc_list:
+        by_value = by_type_lower.get(ioc_entry["type"].lower())
+        if by_value is not None:
+            by_value.setdefault(ioc_entry["ioc"].lower(), {
+                "ioc": ioc_entry["ioc"],
+                "type": ioc_entry["type"],
+                "description": ioc_entry["description"]
+            })
+    scan_types = tuple(t for t in _SCANNED_TYPES if by_type_lower[t])
+    return IocIndex(ioc_list, by_type_lower, _build_automaton(by_type_lower), scan_types)
+
+def _build_automaton(by_type_lower: Dict[str, Dict[str, Dict[str, str]]]):
+    """
+    Aho-Corasick automaton mapping every lowercased domain/url/hash IOC to
+    the IOC types it is listed under, or None without pyahocorasick (or with
+    nothing to scan for).
+    """
+    if ahocorasick is None:
+        return None
+    types_by_value: Dict[str, set] = {}
+    for ioc_type in _SCANNED_TYPES:
+        for value in by_type_lower[ioc_type]:
+            types_by_value.setdefault(value, set()).add(ioc_type)
+    if not types_by_value:
+        return None
+    automaton = ahocorasick.Automaton()
+    for value, types in types_by_value.items():
+        automaton.add_word(value, frozenset(types))
+    automaton.make_automaton()
+    return automaton
+
+def _scan_types(message: str, index: IocIndex):
+    """
+    IOC types worth running the extractors for on `message`. The automaton
+    finds every IOC literal in a single pass; only types with a literal
+    present can produce a hit, so clean messages skip all extractor regexes.
+    The extractors still decide the actual matches (token boundaries).
+
+    Without the automaton, types with no IOCs are skipped, as are types
+    whose tokens need a substring the message lacks (see _REQUIRED_SUBSTRING).
+    """
+    if index.automaton is None:
+        return [t for t in index.scan_types if _REQUIRED_SUBSTRING[t] in message]
+    found = set()
+    for _, types in index.automaton.iter(message.lower()):
+        found |= types
+    # Keep the domain, url, hash order so ioc_hits order is unchanged
+    return [t for t in _SCANNED_TYPES if t in found]
+
+def _post_geoip_batch(slab: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    One ip-api.com batch request for up to GEOIP_BATCH_SIZE IPs (see
+    lookup_geoip_batch). Returns {} if the request itself fails or the
+    reply is not a list of rows (e.g. a rate-limit error body); rows
+    without a string "query" are skipped.
+    """
+    try:
+        response = _SESSION.post(
+            GEOIP_BATCH_URL,
+            json=[{"query": ip, "fields": "status,countryCode,city,query"} for ip in slab],
+            timeout=5
+        )
+        response.raise_for_status()
+        rows = response.json()
+    except Exception:
+        return {}
+    if not isinstance(rows, list):
+        return {}
+    results: Dict[str, Dict[str, str]] = {}
+    for row in rows:
+        if not isinstance(row, dict) or not isinstance(row.get("query"), str):
+            continue
+        if row.get("status") == "success":
+            results[row["query"]] = {
+                "country": row.get("countryCode", ""),
+                "city": row.get("city", "")
+            }
+        else:
+            results[row["query"]] = {}
+    return results
+
+def lookup_geoip_batch(
+    ips: Iterable[str],
+    executor: Optional[Executor] = None
+) -> Dict[str, Dict[str, str]]:
+    """
+    Resolve many IPs through ip-api.com's batch endpoint, GEOIP_BATCH_SIZE
+    per POST over one keep-alive session (POSTs run concurrently on
+    `executor` if given).
+    Returns {ip: {"country": ..., "city": ...}} with {} for IPs the service
+    could not locate; IPs in a request that failed outright are left out.
+    """
+    unique = list(dict.fromkeys(ip for ip in ips if ip))
+    slabs = [unique[start:start + GEOIP_BATCH_SIZE] for start in range(0, len(unique), GEOIP_BATCH_SIZE)]
+    results: Dict[str, Dict[str, str]] = {}
+    for slab_results in (executor.map if executor else map)(_post_geoip_batch, slabs):
+        results.update(slab_results)
+    return results
+
+def prefetch_geoip(
+    records: Iterable[Dict[str, Any]],
+    cache: Dict[str, Dict[str, str]],
+    batch: bool = False,
+    executor: Optional[Executor] = None
+) -> None:
+    """
+    Resolve the not-yet-cached source IPs of `records` into `cache` (see
+    lookup_geoip_cached): with lookup_geoip_batch if `batch`, otherwise with
+    concurrent lookup_geoip calls on `executor` (no-op without one).
+    IPs a batch could not answer are left for per-IP lookups.
+    """
+    ips = [rec.get("src_ip") or extract_ip(rec) for rec in records]
+    missing = [ip for ip in dict.fromkeys(ips) if ip and ip not in cache]
+    if not missing:
+        return
+    if batch:
+        cache.update(lookup_geoip_batch(missing, executor))
+    elif executor is not None:
+        # lookup_geoip is network-bound; requests releases the GIL while waiting
+        cache.update(zip(missing, executor.map(lookup_geoip, missing)))
+
+def iter_geoip_prefetched(
+    records: Iterable[Dict[str, Any]],
+    cache: Dict[str, Dict[str, str]],
+    batch: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Pass `records` through unchanged, first resolving each window of
+    GEOIP_PREFETCH_WINDOW records' new IPs into `cache` on a pool of
+    GEOIP_MAX_WORKERS threads (batch requests if `batch`, see
+    prefetch_geoip), so the lookup_geoip_cached calls that follow hit the
+    cache.
+    """
+    with ThreadPoolExecutor(max_workers=GEOIP_MAX_WORKERS) as executor:
+        for window in iter_batches(records, GEOIP_PREFETCH_WINDOW):
+            prefetch_geoip(window, cache, batch, executor)
+            yield from window
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Yield lists of up to `size` consecutive items.
+    """
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def lookup_geoip_cached(ip: str, cache: Dict[str, Dict[str, str]]) -> Dict[str, str]:
+    """
+    lookup_geoip(ip) memoized in `cache` (a dict owned by the caller, usually
+    one per run), so repeated source IPs cost one HTTP request. Failed
+    lookups ({}) are cached too. Returns a fresh dict each call.
+    """
+    geo = cache.get(ip)
+    if geo is None:
+        geo = cache[ip] = lookup_geoip(ip)
+    return dict(geo)
+
 def enrich_record(
     record: Dict[str, Any],
     ioc_list: List[Dict[str, str]],
-    geoip_enabled: bool = False
+    geoip_enabled: bool = False,
+    index: Optional[IocIndex] = None,
+    geoip_cache: Optional[Dict[str, Dict[str, str]]] = None,
+    inplace: bool = False
 ) -> Dict[str, Any]:
     """
     Enrich a single parsed syslog record with IOC tags and optional GeoIP data.
@@ -112,128 +350,103 @@ def enrich_record(
     - geoip_enabled: if True, every record gets a 'geoip' key:
         * If an IP is found, lookup_geoip(ip)
         * If no IP, {}
-    Returns a shallow copy of `record` with added keys:
+    - index: build_ioc_index(ioc_list), if already built (enrich_all builds it
+      once for all records); built from ioc_list otherwise
+    - geoip_cache: dict shared across calls to reuse GeoIP lookups (see
+      lookup_geoip_cached); every lookup is made when None
+    - inplace: if True, add the keys to `record` itself and return it,
+      saving a dict copy when the caller does not need the original
+    Returns a shallow copy of `record` (or `record`, see inplace) with added keys:
       - 'ioc_hits': List[Dict[str, str]]  (each dict contains 'ioc','type','description')
       - If geoip_enabled=True, always attach 'geoip': { 'country', 'city' } (or empty)
     """
-    enriched = record.copy()
+    if index is None:
+        index = build_ioc_index(ioc_list)
+
+    enriched = record if inplace else record.copy()
     message = enriched.get("message", "")
 
     # 1) Extract or confirm src_ip
     src_ip = enriched.get("src_ip")
-    if not src_ip:
+    if not src_ip and message:
         ip_found = extract_ip(enriched)
         if ip_found:
             enriched["src_ip"] = ip_found
             src_ip = ip_found
 
-    # 2) IOC tagging - Initialize empty list
-    enriched["ioc_hits"] = []
+    # 2) IOC tagging: one dict probe per candidate token
+    hits: List[Dict[str, str]] = []
+    enriched["ioc_hits"] = hits
 
-    # Create sets of IOCs by type for efficient lookup
-    malicious_ips = set()
-    malicious_domains = set()
-    malicious_urls = set()
-    malicious_hashes = set()
-    
-    for ioc_entry in ioc_list:
-        ioc_value = ioc_entry["ioc"].lower()
-        ioc_type = ioc_entry["type"].lower()
-        
-        if ioc_type == "ip":
-            malicious_ips.add(ioc_value)
-        elif ioc_type == "domain":
-            malicious_domains.add(ioc_value)
-        elif ioc_type == "url":
-            malicious_urls.add(ioc_value)
-        elif ioc_type == "hash":
-            malicious_hashes.add(ioc_value)
-
-    # Check for IP IOCs
-    if src_ip and src_ip.lower() in malicious_ips:
-        # Find the matching IOC entry for full details
-        for ioc_entry in ioc_list:
-            if ioc_entry["ioc"].lower() == src_ip.lower() and ioc_entry["type"].lower() == "ip":
-                enriched["ioc_hits"].append({
-                    "ioc": ioc_entry["ioc"],
-                    "type": ioc_entry["type"],
-                    "description": ioc_entry["description"]
-                })
-                break
-
-    # Check for domain IOCs
-    found_domains = extract_domains(message.lower())
-    for domain in found_domains:
-        if domain in malicious_domains:
-            # Find the matching IOC entry for full details
-            for ioc_entry in ioc_list:
-                if ioc_entry["ioc"].lower() == domain and ioc_entry["type"].lower() == "domain":
-                    enriched["ioc_hits"].append({
-                        "ioc": ioc_entry["ioc"],
-                        "type": ioc_entry["type"],
-                        "description": ioc_entry["description"]
-                    })
-                    break
-
-    # Check for URL IOCs
-    found_urls = extract_urls(message.lower())
-    for url in found_urls:
-        if url in malicious_urls:
-            # Find the matching IOC entry for full details
-            for ioc_entry in ioc_list:
-                if ioc_entry["ioc"].lower() == url and ioc_entry["type"].lower() == "url":
-                    enriched["ioc_hits"].append({
-                        "ioc": ioc_entry["ioc"],
-                        "type": ioc_entry["type"],
-                        "description": ioc_entry["description"]
-                    })
-                    break
-
-    # Check for hash IOCs
-    found_hashes = extract_hashes(message.lower())
-    for hash_val in found_hashes:
-        if hash_val in malicious_hashes:
-            # Find the matching IOC entry for full details
-            for ioc_entry in ioc_list:
-                if ioc_entry["ioc"].lower() == hash_val and ioc_entry["type"].lower() == "hash":
-                    enriched["ioc_hits"].append({
-                        "ioc": ioc_entry["ioc"],
-                        "type": ioc_entry["type"],
-                        "description": ioc_entry["description"]
-                    })
-                    break
+    if src_ip:
+        entry = index.by_type_lower["ip"].get(src_ip.lower())
+        if entry is not None:
+            hits.append(dict(entry))
+
+    # An empty message can only match through src_ip
+    if message:
+        for ioc_type in _scan_types(message, index):
+            by_value = index.by_type_lower[ioc_type]
+            # Lowercase the (short) extracted tokens rather than the whole message
+            for value in _EXTRACTORS[ioc_type](message):
+                entry = by_value.get(value.lower())
+                if entry is not None:
+                    hits.append(dict(entry))
 
     # 3) GeoIP enrichment (always attach 'geoip' if requested)
     if geoip_enabled:
-        if src_ip:
+        if src_ip and geoip_cache is not None:
+            enriched["geoip"] = lookup_geoip_cached(src_ip, geoip_cache)
+        elif src_ip:
             enriched["geoip"] = lookup_geoip(src_ip)
         else:
             enriched["geoip"] = {}
 
     return enriched
 
-def enrich_all(
-    records: List[Dict[str, Any]],
-    ioc_list: List[Dict[str, str]],
-    geoip_enabled: bool = False
-) -> List[Dict[str, Any]]:
+def iter_enriched(
+    records: Iterable[Dict[str, Any]],
+    ioc_list: Union[List[Dict[str, str]], IocIndex],
+    geoip_enabled: bool = False,
+    geoip_batch: bool = False,
+    inplace: bool = False
+) -> Iterator[Dict[str, Any]]:
     """
-    Enrich a list of parsed syslog records with IOC tags and optional GeoIP.
-    - records: list of dicts from parse_syslog()
-    - ioc_list: list from load_ioc_list()
-    - geoip_enabled: if True, every record gets a 'geoip' key
-    Returns a new list of enriched dicts.
+    Lazily enrich records one at a time (see enrich_all), so a stream of
+    parsed records can be enriched without materializing it. GeoIP is
+    resolved concurrently, GEOIP_PREFETCH_WINDOW records ahead. With
+    inplace=True the records themselves are updated and yielded (see
+    enrich_record).
     """
-    enriched_records: List[Dict[str, Any]] = []
+    index = ioc_list if isinstance(ioc_list, IocIndex) else build_ioc_index(ioc_list)
+    geoip_cache: Dict[str, Dict[str, str]] = {}
+    if geoip_enabled:
+        records = iter_geoip_prefetched(records, geoip_cache, batch=geoip_batch)
     for rec in records:
         try:
-            enriched = enrich_record(rec, ioc_list, geoip_enabled)
-            enriched_records.append(enriched)
+            yield enrich_record(rec, index.entries, geoip_enabled, index, geoip_cache, inplace)
         except Exception:
             # If enrichment fails for one record, attach minimal fields
-            fallback = rec.copy()
+            fallback = rec if inplace else rec.copy()
             fallback["ioc_hits"] = []
             if geoip_enabled:
                 fallback["geoip"] = {}
-            enriched_records.append(fallback)
-    return enriched_records
\ No newline at end of file
+            yield fallback
+
+def enrich_all(
+    records: List[Dict[str, Any]],
+    ioc_list: Union[List[Dict[str, str]], IocIndex],
+    geoip_enabled: bool = False,
+    geoip_batch: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Enrich a list of parsed syslog records with IOC tags and optional GeoIP.
+    - records: list of dicts from parse_syslog()
+    - ioc_list: list from load_ioc_list(), or an IocIndex from
+      build_ioc_index() to reuse one across calls
+    - geoip_enabled: if True, every record gets a 'geoip' key
+    - geoip_batch: if True, resolve IPs with ip-api.com's batch endpoint
+      (GEOIP_BATCH_SIZE per request) instead of one request per IP
+    Returns a new list of enriched dicts.
+    """
+    return list(iter_enriched(records, ioc_list, geoip_enabled, geoip_batch))
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+blue_team_ai/output.py — JSON encoding and stdout writing shared by the CLIs.
+"""
+import json
+import sys
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; fall back to the stdlib json module
+    orjson = None
+
+
+def json_default(obj):
+    """
+    Encoder hook for the few non-JSON types a record can carry (sets, paths,
+    datetimes under stdlib json). Only called for values the encoder cannot
+    handle natively; anything else unknown is written as its str().
+    """
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def dumps(obj) -> bytes:
+    """
+    Compact JSON encoding as bytes (orjson when installed, else stdlib json).
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default)
+    return json.dumps(obj, default=json_default).encode("utf-8")
+
+
+def stdout_writer():
+    """
+    Return a bytes writer for stdout, encoding through the text layer when
+    stdout has no binary buffer (e.g. replaced by a StringIO).
+    """
+    sys.stdout.flush()
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is not None:
+        return buffer.write
+    return lambda data: sys.stdout.write(data.decode("utf-8"))
@@ -15,36 +15,18 @@ Examples:
 
 import re
 import argparse
-import json
-import sys
-
-from blue_team_ai.exceptions.unsupported_format import UnsupportedFormat
-
-# Regex for minimal RFC5424 format:
-SYSLOG_REGEX = re.compile(
-    r'^<(?P<pri>\d+)>'                   # Priority
-    r'(?P<version>\d+)\s+'               # Version
-    r'(?P<timestamp>\S+)\s+'             # Timestamp
-    r'(?P<host>\S+)\s+'                  # Hostname
-    r'(?P<appname>\S+)\s+'               # Application name
-    r'(?P<procid>\S+)\s+'                # Process ID
-    r'(?P<msgid>\S+)\s+'                 # Message ID
-    r'(?P<structured_data>(?:-|\[.*?\]))\s+'  # Structured data (or '-')
-    r'(?P<message>.*)$'                  # Message text
-)
-
-#!/usr/bin/env python3
-"""
-parse_logs.py — Parse RFC5424-style syslog lines into a dict or raise UnsupportedFormat.
-"""
-
-import re
 import datetime
+import functools
+import sys
 
 from blue_team_ai.exceptions.unsupported_format import UnsupportedFormat
+from blue_team_ai.output import dumps, stdout_writer
 
 # Regex for minimal RFC5424 format:
 #   <PRI>VERSION TIMESTAMP HOST APP PROCID MSGID STRUCTURED-DATA MSG
+# Structured data is one or more [...] elements whose bodies may contain
+# escaped "\]"; matching them with negated classes rather than a lazy ".*?"
+# keeps malformed lines from backtracking over the rest of the line.
 SYSLOG_REGEX = re.compile(
     r'^<(?P<pri>\d+)>'                          # Priority
     r'(?P<version>\d+) '                        # Version
@@ -53,10 +35,36 @@ SYSLOG_REGEX = re.compile(
     r'(?P<appname>\S+) '                        # Application name
     r'(?P<procid>\S+) '                         # Process ID
     r'(?P<msgid>\S+) '                          # Message ID
-    r'(?P<structured_data>(?:-|\[.*?\])) '       # Structured data (or '-')
-    r'(?P<message>.*)$'                         # Message text
+    r'(?P<structured_data>-|(?:\[[^\]\\]*(?:\\.[^\]\\]*)*\])+) '  # Structured data (or '-')
+    r'(?P<message>.*)$',                        # Message text
+    re.ASCII                                    # \d / \S without Unicode tables
 )
 
+if sys.version_info >= (3, 11):
+    # fromisoformat accepts a trailing "Z" natively from 3.11; skipping the
+    # replace() saves a string copy per line
+    _fromisoformat = datetime.datetime.fromisoformat
+else:
+    def _fromisoformat(ts: str) -> datetime.datetime:
+        # Replace Z with +00:00 for Python parsing
+        return datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_timestamp(ts: str) -> bool:
+    """
+    Whether `ts` parses as ISO-8601. Memoized, since bursts of lines share
+    the same second-resolution timestamp.
+    """
+    try:
+        _fromisoformat(ts)
+    except Exception:
+        return False
+    return True
+
+# Characters read per batch by the command-line tool
+READ_CHUNK_SIZE = 1 << 20
+
 def parse_syslog(log_str: str) -> dict:
     """
     Parse a single syslog line in RFC5424 format into its components.
@@ -74,15 +82,42 @@ def parse_syslog(log_str: str) -> dict:
 
     # Validate timestamp is ISO-8601 (e.g. 2025-05-15T14:31:02Z)
     ts = record["timestamp"]
-    try:
-        # Replace Z with +00:00 for Python parsing
-        datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
-    except Exception:
+    if not _is_valid_timestamp(ts):
         raise UnsupportedFormat(f"Invalid timestamp: '{ts}'")
 
+    # Low-cardinality fields: share one string object per distinct value
+    record["host"] = sys.intern(record["host"])
+    record["appname"] = sys.intern(record["appname"])
+
     return record
 
 
+def iter_line_batches(infile, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Read `infile` `chunk_size` characters at a time and yield each chunk's
+    complete lines (without their newline) as a list. A final line with no
+    trailing newline is yielded on its own.
+    """
+    leftover = ""
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        lines = (leftover + chunk).split("\n")
+        leftover = lines.pop()
+        yield lines
+    if leftover:
+        yield [leftover]
+
+
+def _write_batch(write, encoded: list):
+    """
+    Write a batch of JSON-encoded records, one per line, in a single call.
+    """
+    if encoded:
+        write(b"\n".join(encoded) + b"\n")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Parse syslog file (RFC5424) and output JSON dict per entry"
@@ -108,26 +143,31 @@ def main():
     # Open output handle
     if args.output:
         try:
-            out_fh = open(args.output, "w")
+            out_fh = open(args.output, "wb")
         except IOError as e:
             print(f"Error: cannot open output file {args.output}: {e}", file=sys.stderr)
             sys.exit(1)
     else:
-        out_fh = sys.stdout
+        out_fh = None
+    write = out_fh.write if out_fh is not None else stdout_writer()
 
     try:
         with open(args.file, "r") as infile:
-            for raw_line in infile:
-                try:
-                    parsed = parse_syslog(raw_line)
-                    out_fh.write(json.dumps(parsed) + "\n")
-                except UnsupportedFormat as e:
-                    if args.ignore_errors:
-                        print(f"Warning: {e}", file=sys.stderr)
-                        continue
-                    else:
-                        print(f"Error: {e}", file=sys.stderr)
-                        sys.exit(1)
+            for lines in iter_line_batches(infile):
+                encoded = []
+                for line in lines:
+                    try:
+                        encoded.append(dumps(parse_syslog(line)))
+                    except UnsupportedFormat as e:
+                        if args.ignore_errors:
+                            print(f"Warning: {e}", file=sys.stderr)
+                            continue
+                        else:
+                            # Keep the records parsed before the bad line
+                            _write_batch(write, encoded)
+                            print(f"Error: {e}", file=sys.stderr)
+                            sys.exit(1)
+                _write_batch(write, encoded)
     except FileNotFoundError:
         print(f"Error: file not found - {args.file}", file=sys.stderr)
         sys.exit(1)
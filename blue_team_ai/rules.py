@@ -3,96 +3,232 @@
 blue_team_ai/rules.py — Rule engine for detecting suspicious patterns in enriched syslog records.
 """
 from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+
+try:
+    from ciso8601 import parse_datetime as _fromiso
+except ImportError:  # optional C ISO-8601 parser; fall back to the stdlib
+    _fromiso = datetime.fromisoformat
+
+# Default SSH brute-force rule: more than SSH_THRESHOLD failures per host
+# within SSH_WINDOW_SEC seconds
+SSH_WINDOW_SEC = 60
+SSH_THRESHOLD = 5
+
+# Hosts with fewer failures than this are scanned in pure Python; below it
+# the array conversion costs more than the JIT saves. numba (optional) is
+# only imported once a host reaches it.
+JIT_MIN_FAILURES = 1000
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_ONE_US = timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=8192)
+def _to_epoch_us(ts: Any) -> Optional[int]:
+    """
+    Convert an ISO-8601 timestamp to integer microseconds since the epoch
+    (naive timestamps are taken as UTC), or None if it cannot be parsed.
+    Memoized: bursts of failures share the same second-resolution string.
+    """
+    try:
+        dt = _fromiso(ts)
+    except Exception:
+        return None
+    return (dt - (_EPOCH if dt.tzinfo is None else _EPOCH_UTC)) // _ONE_US
+
+
+def _scan_window(times: Sequence[int], window: int, threshold: int) -> Tuple[int, int]:
+    """
+    Two-pointer sweep over ascending `times`: return (index, count) for the
+    first window [times[index], times[index] + window) holding more than
+    `threshold` entries, or (-1, 0) if there is none. `right` only moves
+    forward, so the scan is O(n).
+    """
+    n = len(times)
+    right = 0
+    for left in range(n):
+        end_time = times[left] + window
+        if right < left:
+            right = left
+        while right < n and times[right] < end_time:
+            right += 1
+        if right - left > threshold:
+            return left, right - left
+    return -1, 0
+
+
+# numba build of _scan_window and the numpy module it runs on: None until
+# first needed, False when numba/numpy are not installed
+_scan_window_jit: Any = None
+_np: Any = None
+
+
+def _scan_window_compiled(times: Sequence[int], window: int, threshold: int) -> Tuple[int, int]:
+    """
+    _scan_window() JIT-compiled with numba over an int64 array. numba and
+    numpy are imported, and the kernel compiled, on the first call, so runs
+    that never see a noisy host do not pay for them. Falls back to the
+    pure-Python scan when numba is not installed.
+    """
+    global _scan_window_jit, _np
+    if _scan_window_jit is None:
+        try:
+            import numpy
+            from numba import njit
+        except ImportError:
+            _scan_window_jit = False
+        else:
+            _np = numpy
+            _scan_window_jit = njit(cache=True)(_scan_window)
+    if _scan_window_jit is False:
+        return _scan_window(times, window, threshold)
+    return _scan_window_jit(_np.array(times, dtype=_np.int64), window, threshold)
+
+
+def _collect_ssh_failure(
+    failures: Dict[str, List[Tuple[int, str]]],
+    r: Dict[str, Any]
+) -> None:
+    """
+    Record an sshd record's (epoch microseconds, timestamp) under its host
+    if its message is an authentication failure with a parseable timestamp.
+    """
+    msg = r.get("message", "")
+    # Look for common failure patterns
+    if "Failed password" in msg or "authentication failure" in msg:
+        ts = r.get("timestamp")
+        try:
+            epoch_us = _to_epoch_us(ts)
+        except TypeError:  # unhashable timestamp value
+            return
+        if epoch_us is not None:
+            failures[r.get("host")].append((epoch_us, ts))
+
+
+def _bruteforce_alerts(
+    failures: Dict[str, List[Tuple[int, str]]],
+    window_sec: int,
+    threshold: int
+) -> List[Dict[str, Any]]:
+    """
+    Emit one ssh_bruteforce alert per host whose failures exceed `threshold`
+    within some `window_sec` window.
+    """
+    window_us = window_sec * 1_000_000
+    alerts: List[Dict[str, Any]] = []
+    for host, entries in failures.items():
+        # Too few failures to ever exceed the threshold
+        if len(entries) <= threshold:
+            continue
+        # Stable sort on the instant only, so ties keep arrival order
+        entries.sort(key=itemgetter(0))
+        times = [epoch_us for epoch_us, _ in entries]
+        if times[-1] - times[0] < window_us:
+            # The whole series fits in the first window
+            left, count = 0, len(times)
+        elif len(times) >= JIT_MIN_FAILURES:
+            left, count = _scan_window_compiled(times, window_us, threshold)
+        else:
+            left, count = _scan_window(times, window_us, threshold)
+        if left >= 0:
+            alerts.append({
+                "rule": "ssh_bruteforce",
+                "host": host,
+                "first_seen": _fromiso(entries[left][1]).isoformat(),
+                "count": count,
+                "description": f"{count} SSH failures in {window_sec}s"
+            })
+    return alerts
+
+
+def _is_non_root_cron(r: Dict[str, Any]) -> bool:
+    # Root jobs log their message as '(root) CMD (...)'
+    return r.get("appname") == "cron" and not r.get("message", "").startswith("(root)")
+
+
+def _cron_alert(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "rule": "cron_non_root",
+        "host": r.get("host"),
+        "timestamp": r.get("timestamp"),
+        "description": "Cron job run by non-root user"
+    }
+
+
+def _ioc_alert(r: Dict[str, Any], hits: List[Dict[str, str]]) -> Dict[str, Any]:
+    return {
+        "rule": "ioc_hit",
+        "host": r.get("host"),
+        "timestamp": r.get("timestamp"),
+        "ioc_details": hits
+    }
 
 
 def detect_ssh_bruteforce(
     records: List[Dict[str, Any]],
-    window_sec: int = 60,
-    threshold: int = 5
+    window_sec: int = SSH_WINDOW_SEC,
+    threshold: int = SSH_THRESHOLD
 ) -> List[Dict[str, Any]]:
     """
     Detect SSH brute-force: more than `threshold` failed auths within `window_sec`.
     """
-    failures: Dict[str, List[datetime]] = defaultdict(list)
+    # Timestamps are compared as integer microseconds; the original string
+    # is kept for `first_seen`.
+    failures: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
     for r in records:
         if r.get("appname") == "sshd":
-            msg = r.get("message", "")
-            # Look for common failure patterns
-            if "Failed password" in msg or "authentication failure" in msg:
-                ts = r.get("timestamp")
-                try:
-                    failures[r.get("host")].append(datetime.fromisoformat(ts))
-                except Exception:
-                    continue
-    alerts: List[Dict[str, Any]] = []
-    for host, times in failures.items():
-        times.sort()
-        for i, start in enumerate(times):
-            end_time = start + timedelta(seconds=window_sec)
-            count = sum(1 for t in times if start <= t < end_time)
-            if count > threshold:
-                alerts.append({
-                    "rule": "ssh_bruteforce",
-                    "host": host,
-                    "first_seen": start.isoformat(),
-                    "count": count,
-                    "description": f"{count} SSH failures in {window_sec}s"
-                })
-                break
-    return alerts
+            _collect_ssh_failure(failures, r)
+    return _bruteforce_alerts(failures, window_sec, threshold)
 
 
 def detect_suspicious_cron(
-    records: List[Dict[str, Any]]
+    records: Iterable[Dict[str, Any]]
 ) -> List[Dict[str, Any]]:
     """
     Detect cron jobs executed by non-root users.
     """
-    alerts: List[Dict[str, Any]] = []
-    for r in records:
-        if r.get("appname") == "cron":
-            msg = r.get("message", "")
-            # Skip root jobs (message starts with '(root)')
-            if msg.startswith("(root)"):
-                continue
-            alerts.append({
-                "rule": "cron_non_root",
-                "host": r.get("host"),
-                "timestamp": r.get("timestamp"),
-                "description": "Cron job run by non-root user"
-            })
-    return alerts
+    return [_cron_alert(r) for r in records if _is_non_root_cron(r)]
 
 
 def detect_ioc_hits(
-    records: List[Dict[str, Any]]
+    records: Iterable[Dict[str, Any]]
 ) -> List[Dict[str, Any]]:
     """
     Detect any record with IOC hits.
     """
-    alerts: List[Dict[str, Any]] = []
-    for r in records:
-        hits = r.get("ioc_hits", [])
-        if hits:
-            alerts.append({
-                "rule": "ioc_hit",
-                "host": r.get("host"),
-                "timestamp": r.get("timestamp"),
-                "ioc_details": hits
-            })
-    return alerts
+    return [_ioc_alert(r, hits) for r in records if (hits := r.get("ioc_hits"))]
 
 
 def apply_rules(
-    records: List[Dict[str, Any]]
+    records: Iterable[Dict[str, Any]]
 ) -> List[Dict[str, Any]]:
     """
-    Apply all detection rules to the list of records.
+    Apply all detection rules to the records (any iterable; it is consumed
+    once and only alerts and SSH failure timestamps are kept).
+
+    All three detectors run in one pass over the records; brute-force
+    alerts are emitted after the pass since they need every failure per
+    host. Alerts are ordered brute-force, cron, then IOC hits, as when the
+    detectors run one after another.
     """
-    alerts: List[Dict[str, Any]] = []
-    alerts.extend(detect_ssh_bruteforce(records))
-    alerts.extend(detect_suspicious_cron(records))
-    alerts.extend(detect_ioc_hits(records))
+    failures: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    cron_alerts: List[Dict[str, Any]] = []
+    ioc_alerts: List[Dict[str, Any]] = []
+    for r in records:
+        if r.get("appname") == "sshd":
+            _collect_ssh_failure(failures, r)
+        elif _is_non_root_cron(r):
+            cron_alerts.append(_cron_alert(r))
+        hits = r.get("ioc_hits")
+        if hits:
+            ioc_alerts.append(_ioc_alert(r, hits))
+
+    alerts = _bruteforce_alerts(failures, SSH_WINDOW_SEC, SSH_THRESHOLD)
+    alerts.extend(cron_alerts)
+    alerts.extend(ioc_alerts)
     return alerts
@@ -1,31 +1,133 @@
 # tests/test_ai.py
 
+import asyncio
+import json
+from types import SimpleNamespace
+
 import pytest
 
-# We want to test ai.classify_record without loading the real DeepSeek model.
-# So we temporarily monkeypatch DeepSeek to use a dummy classifier.
+# We want to test ai.classify_record without calling OpenRouter.
+# So we monkeypatch the client factory to hand out fake clients.
 import blue_team_ai.ai as ai_module
+import blue_team_ai.cli as cli_module
+
+_real_get_batch_client = ai_module._get_batch_client
+
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _reply_for(params):
+    """
+    Fake model: label by keyword in the user prompt, as compact JSON.
+    """
+    prompt = params["messages"][-1]["content"].lower()
+    if "root" in prompt:
+        return '{"label":"anomalous","score":0.99}'
+    return '{"label":"normal","score":0.01}'
+
+
+class FakeCompletions:
+    def __init__(self, reply=_reply_for):
+        self.reply = reply
+        self.calls = []
+
+    def create(self, **params):
+        self.calls.append(params)
+        content = self.reply(params)
+        if isinstance(content, Exception):
+            raise content
+        return _completion(content)
+
+
+class AsyncFakeCompletions(FakeCompletions):
+    async def create(self, **params):
+        return FakeCompletions.create(self, **params)
+
+
+class FakeBatchApi:
+    """
+    In-memory stand-in for client.files / client.batches: the batch finishes
+    with `status` on the first poll, answering each request with `reply`
+    (rows whose reply is None come back as errored requests).
+    """
+
+    def __init__(self, reply=_reply_for, status="completed"):
+        self.reply = reply
+        self.status = status
+        self.files = {}
+        self.uploaded = []
+
+    # client.files
+    def create(self, file, purpose):
+        _, data = file
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = data.decode("utf-8")
+        self.uploaded.append([json.loads(line) for line in self.files[file_id].splitlines()])
+        return SimpleNamespace(id=file_id)
+
+    def content(self, file_id):
+        return SimpleNamespace(text=self.files[file_id])
+
+    # client.batches
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        self.input_file_id = input_file_id
+        return SimpleNamespace(id="batch-1", status="in_progress", output_file_id=None)
+
+    def retrieve(self, batch_id):
+        if self.status != "completed":
+            return SimpleNamespace(id=batch_id, status=self.status, output_file_id=None)
+        rows = []
+        for request in self.uploaded[-1]:
+            content = self.reply(request["body"])
+            if content is None:
+                rows.append({"custom_id": request["custom_id"], "error": {"message": "boom"}})
+            else:
+                rows.append({
+                    "custom_id": request["custom_id"],
+                    "response": {"body": {"choices": [{"message": {"content": content}}]}},
+                })
+        self.files["file-out"] = "\n".join(json.dumps(row) for row in rows)
+        return SimpleNamespace(id=batch_id, status="completed", output_file_id="file-out")
+
+
+class FakeClient:
+    def __init__(self, completions=None, batch_api=None):
+        self.completions = completions or FakeCompletions()
+        self.chat = SimpleNamespace(completions=self.completions)
+        self.batch_api = batch_api or FakeBatchApi()
+        self.files = SimpleNamespace(create=self.batch_api.create, content=self.batch_api.content)
+        self.batches = SimpleNamespace(create=self.batch_api.create_batch, retrieve=self.batch_api.retrieve)
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
 
-class DummyModel:
-    def classify(self, text):
-        # Return a simple label/score based on keywords
-        if "fail" in text.lower():
-            return {"label": "anomaly", "score": 0.99}
-        return {"label": "normal", "score": 0.01}
 
 @pytest.fixture(autouse=True)
-def patch_deepseek(monkeypatch):
+def fake_client(monkeypatch):
     """
-    Before each test, replace the internal _model with DummyModel().
+    Before each test, replace the OpenRouter client with a FakeClient and
+    start from an empty classification cache with no rate limiter.
     """
-    monkeypatch.setattr(ai_module, "_model", DummyModel())
-    yield
+    client = FakeClient()
+    monkeypatch.setattr(ai_module, "_get_client", lambda: client)
+    monkeypatch.setattr(ai_module, "_get_batch_client", lambda: client)
+    monkeypatch.setattr(ai_module, "_exact_cache", {})
+    monkeypatch.setattr(ai_module, "_cache_dirty", False)
+    monkeypatch.setattr(ai_module, "_rate_limiter", None)
+    yield client
+
 
-def test_classify_record_anomaly():
-    rec = {"message": "Failed password attempt from 1.2.3.4"}
+def test_classify_record_anomaly(fake_client):
+    rec = {"message": "Login attempt for root from 1.2.3.4"}
     result = ai_module.classify_record(rec)
-    assert result["ai_label"] == "anomaly"
+    assert result["ai_label"] == "anomalous"
     assert result["ai_score"] == pytest.approx(0.99)
+    assert result["threat_level"] == 0
+    assert "root from 1.2.3.4" in fake_client.completions.calls[0]["messages"][-1]["content"]
+
 
 def test_classify_record_normal():
     rec = {"message": "User login succeeded for user1"}
@@ -33,26 +135,253 @@ def test_classify_record_normal():
     assert result["ai_label"] == "normal"
     assert result["ai_score"] == pytest.approx(0.01)
 
+
 def test_classify_empty_message():
     rec = {"message": ""}
     result = ai_module.classify_record(rec)
     assert result["ai_label"] == ""
     assert result["ai_score"] == 0.0
 
+
 def test_classify_missing_message_key():
     rec = {}  # no "message" key
     result = ai_module.classify_record(rec)
     assert result["ai_label"] == ""
     assert result["ai_score"] == 0.0
 
-def test_classify_exception(monkeypatch):
-    # Force the model to throw an exception
-    class BrokenModel:
-        def classify(self, text):
-            raise RuntimeError("oops")
-    monkeypatch.setattr(ai_module, "_model", BrokenModel())
+
+def test_classify_exception(fake_client):
+    # Force the API call to throw; the keyword fallback labels the record
+    fake_client.completions.reply = lambda params: RuntimeError("oops")
 
     rec = {"message": "Any log"}
     result = ai_module.classify_record(rec)
-    assert result["ai_label"] == "error"
-    assert result["ai_score"] == 0.0
+    assert result["ai_label"] == "normal"
+    assert result["ai_score"] == 0.5
+
+
+def test_classify_without_client(monkeypatch):
+    monkeypatch.setattr(ai_module, "_get_client", lambda: None)
+    result = ai_module.classify_record({"message": "User login succeeded"})
+    assert result == {"ai_label": "", "ai_score": 0.0, "threat_level": 0}
+
+
+@pytest.mark.parametrize("rec, label", [
+    ({"message": "Login ok", "ioc_hits": [{"ioc": "1.2.3.4", "type": "ip", "description": "x"}]}, "malicious"),
+    ({"message": "Exploit attempt detected"}, "malicious"),
+    ({"message": "Connection blocked by firewall"}, "anomalous"),
+])
+def test_local_labels_skip_the_api(fake_client, rec, label):
+    result = ai_module.classify_record(rec)
+    assert result["ai_label"] == label
+    assert fake_client.completions.calls == []
+
+
+def test_exact_cache_reuses_classification(fake_client, monkeypatch):
+    rec = {"message": "User login succeeded for user1"}
+    first = ai_module.classify_record(rec)
+    assert ai_module.classify_record(dict(rec)) == first
+    assert len(fake_client.completions.calls) == 1
+
+    # A different model or prompt version must not reuse the cached label
+    monkeypatch.setattr(ai_module, "MODEL_NAME", "other/model")
+    ai_module.classify_record(rec)
+    monkeypatch.setattr(ai_module, "PROMPT_VERSION", ai_module.PROMPT_VERSION + 1)
+    ai_module.classify_record(rec)
+    assert len(fake_client.completions.calls) == 3
+
+
+def test_cache_save_and_load(tmp_path, fake_client):
+    cache_file = tmp_path / "ai_cache.json"
+    ai_module.classify_record({"message": "User login succeeded for user1"})
+    ai_module.save_cache(cache_file)
+
+    ai_module._exact_cache.clear()
+    entries = json.loads(cache_file.read_text())
+    entries["not-a-key"] = {"ai_label": "normal", "ai_score": 0.1, "threat_level": 1}
+    entries["0" * 64] = {"ai_label": "normal", "ai_score": "high", "threat_level": 1}
+    cache_file.write_text(json.dumps(entries))
+
+    assert ai_module.load_cache(cache_file) == 1
+    ai_module.classify_record({"message": "User login succeeded for user1"})
+    assert len(fake_client.completions.calls) == 1
+
+
+def test_load_cache_missing_file(tmp_path):
+    assert ai_module.load_cache(tmp_path / "missing.json") == 0
+
+
+def test_build_prompt_truncates_and_collapses_whitespace():
+    message = "User\tlogin \n\n succeeded\r\n" + "x" * (2 * ai_module.PROMPT_MAX_MESSAGE_CHARS)
+    prompt = ai_module._build_prompt(message)
+    body = prompt[len(ai_module._PROMPT_LOG_PREFIX):]
+    assert prompt.startswith(ai_module._PROMPT_LOG_PREFIX)
+    assert body.startswith("User login succeeded xxx")
+    assert not any(c in body for c in "\t\r\n")
+    assert len(body) < ai_module.PROMPT_MAX_MESSAGE_CHARS
+
+
+def test_long_message_keywords_and_cache_use_full_message(fake_client):
+    head = "session\tdata\n" + "x" * ai_module.PROMPT_MAX_MESSAGE_CHARS
+    # The keyword sits past the prompt cut-off and is still seen
+    assert ai_module.classify_record({"message": head + " exploit"})["ai_label"] == "malicious"
+    assert fake_client.completions.calls == []
+
+    # Same prompt after truncation, but different messages: separate cache entries
+    ai_module.classify_record({"message": head + " tail one"})
+    ai_module.classify_record({"message": head + " tail two"})
+    calls = fake_client.completions.calls
+    assert len(calls) == 2
+    assert calls[0]["messages"] == calls[1]["messages"]
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('{"label":"Malicious","score":0.9}', {"ai_label": "malicious", "ai_score": 0.9, "threat_level": -1}),
+    ('{"label":"normal","score":null}', {"ai_label": "normal", "ai_score": None, "threat_level": 1}),
+    ('{"label":"normal","score":"high"}', {"ai_label": "normal", "ai_score": None, "threat_level": 1}),
+    ("Label: anomalous, Confidence: 0.7", {"ai_label": "anomalous", "ai_score": 0.7, "threat_level": 0}),
+    ("no idea", None),
+    (None, None),
+])
+def test_parse_response(content, expected):
+    assert ai_module._parse_response(content) == expected
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (None, None), ("", None), ("0", None), ("abc", None), ("-5", None), ("inf", None), ("120", 120.0),
+])
+def test_requests_per_minute(raw, expected):
+    assert ai_module._requests_per_minute(raw) == expected
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_spaces_bursts(monkeypatch):
+    clock = FakeClock()
+    sleeps = []
+    monkeypatch.setattr(ai_module.time, "monotonic", clock)
+    monkeypatch.setattr(ai_module.time, "sleep", sleeps.append)
+    limiter = ai_module.RateLimiter(60)  # one token per second, bursts of 60
+
+    for _ in range(60):
+        limiter.acquire()
+    assert sleeps == []
+
+    # Past the burst, each caller reserves the next free second
+    limiter.acquire()
+    limiter.acquire()
+    assert sleeps == pytest.approx([1.0, 2.0])
+
+    # Elapsed time refills the bucket before the next reservation
+    clock.now += 1.5
+    assert limiter._reserve() == pytest.approx(1.5)
+    clock.now += 100
+    assert limiter._reserve() == 0.0
+    assert limiter.tokens == pytest.approx(59.0)
+
+
+def test_rate_limiter_acquire_async(monkeypatch):
+    clock = FakeClock()
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(ai_module.time, "monotonic", clock)
+    monkeypatch.setattr(ai_module.asyncio, "sleep", fake_sleep)
+    limiter = ai_module.RateLimiter(2, per=1.0)  # two per second
+
+    async def burst():
+        await asyncio.gather(*(limiter.acquire_async() for _ in range(5)))
+
+    asyncio.run(burst())
+    assert sleeps == pytest.approx([0.5, 1.0, 1.5])
+
+
+@pytest.mark.parametrize("rate, per", [(0, 60.0), (-1, 60.0), (10, 0)])
+def test_rate_limiter_rejects_non_positive_settings(rate, per):
+    with pytest.raises(ValueError):
+        ai_module.RateLimiter(rate, per)
+
+
+def test_classify_record_async():
+    client = FakeClient(completions=AsyncFakeCompletions())
+    result = asyncio.run(ai_module.classify_record_async({"message": "Login attempt for root"}, client))
+    assert result["ai_label"] == "anomalous"
+    assert len(client.completions.calls) == 1
+
+
+def test_cli_classify_records_concurrently(monkeypatch):
+    client = FakeClient(completions=AsyncFakeCompletions())
+    monkeypatch.setattr(ai_module, "new_async_client", lambda: client)
+    records = [{"message": f"User login succeeded for user{i}"} for i in range(5)]
+    records.append({"message": "Login attempt for root"})
+
+    asyncio.run(cli_module.classify_records(records, concurrency=2))
+
+    assert [r["ai_label"] for r in records] == ["normal"] * 5 + ["anomalous"]
+    assert len(client.completions.calls) == 6
+    assert client.closed
+
+
+def test_classify_records_batch(fake_client):
+    def reply(params):
+        # The second distinct message errors inside the batch
+        if "user2" in params["messages"][-1]["content"]:
+            return None
+        return _reply_for(params)
+
+    fake_client.batch_api.reply = reply
+    records = [
+        {"message": "Login attempt for root"},
+        {"message": "User login succeeded for user2"},
+        {"message": "Login attempt for root"},          # duplicate: submitted once
+        {"message": "Connection blocked by firewall"},  # keyword label, never submitted
+        {"message": ""},
+    ]
+
+    results = ai_module.classify_records_batch(records, poll_interval=0)
+
+    assert len(fake_client.batch_api.uploaded[0]) == 2
+    assert [r["ai_label"] for r in results] == ["anomalous", "normal", "anomalous", "anomalous", ""]
+    assert results[1]["ai_score"] == 0.5  # keyword fallback for the errored request
+    assert results[0] is not results[2]
+    assert fake_client.completions.calls == []
+
+
+@pytest.mark.parametrize("status", ["failed", "expired"])
+def test_classify_records_batch_unfinished_raises(fake_client, status):
+    fake_client.batch_api.status = status
+    with pytest.raises(RuntimeError):
+        ai_module.classify_records_batch([{"message": "User login succeeded"}], poll_interval=0)
+
+
+def test_classify_records_batch_needs_batch_endpoint(monkeypatch):
+    monkeypatch.setattr(ai_module, "_get_batch_client", _real_get_batch_client)
+    monkeypatch.setattr(ai_module, "_batch_client", None)
+    monkeypatch.setattr(ai_module, "AI_BATCH_BASE_URL", "")
+
+    # Nothing to submit: no endpoint needed
+    results = ai_module.classify_records_batch([{"message": "Exploit attempt detected"}], poll_interval=0)
+    assert results[0]["ai_label"] == "malicious"
+
+    with pytest.raises(RuntimeError, match="AI_BATCH_BASE_URL"):
+        ai_module.classify_records_batch([{"message": "User login succeeded"}], poll_interval=0)
+
+
+def test_cli_batch_falls_back_to_per_record_requests(fake_client, monkeypatch):
+    fake_client.batch_api.status = "expired"
+    async_client = FakeClient(completions=AsyncFakeCompletions())
+    monkeypatch.setattr(ai_module, "new_async_client", lambda: async_client)
+    records = [{"message": "User login succeeded"}]
+
+    cli_module.classify_records_batch(records)
+
+    assert records[0]["ai_label"] == "normal"
+    assert len(async_client.completions.calls) == 1
@@ -1,5 +1,6 @@
 # tests/test_cli_smoke.py
 
+import io
 import json
 import sys
 import tempfile
@@ -8,19 +9,21 @@ from pathlib import Path
 import pytest
 
 # We’ll import the CLI's main() function
-from blue_team_ai.cli import main
+from blue_team_ai.cli import main, load_file, process_records, write_summary
 
 # Monkeypatch objects at import time
 import blue_team_ai.parsers.parse_logs as parser_module
 import blue_team_ai.rules as rules_module
 import blue_team_ai.enrichment as enrichment_module
 import blue_team_ai.ai as ai_module
+import blue_team_ai.cli as cli_module
 
 @pytest.fixture(autouse=True)
 def patch_everything(monkeypatch):
     """
-    Replace parse_syslog, apply_rules, lookup_geoip, classify_record with stubs
-    so we can test the CLI pipeline without external dependencies.
+    Replace parse_syslog, apply_rules, lookup_geoip, classify_record and the
+    OpenRouter clients with stubs so we can test the CLI pipeline without
+    external dependencies.
     """
     # 1) Stub parse_syslog to return a predictable dict
     def dummy_parse_syslog(line: str):
@@ -41,6 +44,11 @@ def patch_everything(monkeypatch):
     # 4) Stub classify_record to return a fixed label/score
     monkeypatch.setattr(ai_module, "classify_record", lambda r: {"ai_label": "normal", "ai_score": 0.5})
 
+    # 5) No OpenRouter clients, even with DEEPSEEK_API_KEY set: the async
+    #    path then defers to the classify_record stub above
+    monkeypatch.setattr(ai_module, "_get_client", lambda: None)
+    monkeypatch.setattr(ai_module, "new_async_client", lambda: None)
+
     yield
 
 def run_cli_and_capture(tmp_path, extra_args=None):
@@ -134,3 +142,104 @@ def test_cli_enrich_geoip_ai(tmp_path):
         assert r["geoip"] == {"country": "ZZ", "city": "TestCity"}
         assert "ai_label" in r and r["ai_label"] == "normal"
         assert "ai_score" in r and r["ai_score"] == 0.5
+
+def test_load_file_splits_on_newline_only(tmp_path):
+    """
+    Unicode line separators inside a message must not split the line.
+    """
+    sample = tmp_path / "sep.log"
+    lines = [
+        "<34>1 2025-05-26T14:00:00Z host1 sshd - - - Failed password\u2028for root",
+        "<34>1 2025-05-26T14:01:00Z host2 sshd - - - User login succeeded",
+    ]
+    sample.write_text("\r\n".join(lines) + "\n\n", encoding="utf-8")
+
+    assert load_file(sample) == lines
+
+
+STREAM_LINES = [
+    f"<34>1 2025-05-26T14:00:{sec:02d}Z host1 sshd - - - Failed password for root from 10.0.0.1"
+    for sec in range(0, 60, 10)
+] + ["<78>1 2025-05-26T14:02:00Z host1 cron - - - (alice) CMD (backup.sh)"]
+
+
+@pytest.mark.parametrize("do_rules, records, parsed", [
+    (False, 7, 7),
+    (True, 2, None),  # one brute-force alert, one non-root cron alert
+])
+def test_write_summary_streams_valid_json(do_rules, records, parsed):
+    """
+    The streamed document must parse as one JSON object with the right counts.
+    """
+    out = io.BytesIO()
+    output_records = process_records(
+        STREAM_LINES, do_enrich=False, ioc_file=None, geoip_enabled=False,
+        do_rules=do_rules, do_ai=False
+    )
+    count = write_summary(out.write, len(STREAM_LINES), output_records, do_rules)
+
+    doc = json.loads(out.getvalue())
+    assert count == records
+    assert doc["total_lines"] == len(STREAM_LINES)
+    assert len(doc["records"]) == records
+    assert doc["parsed_records"] == parsed
+    assert doc["output_records"] == records
+    if do_rules:
+        assert [a["rule"] for a in doc["records"]] == ["ssh_bruteforce", "cron_non_root"]
+
+
+def test_write_summary_empty_records():
+    out = io.BytesIO()
+    assert write_summary(out.write, 3, iter(()), False) == 0
+    assert json.loads(out.getvalue()) == {
+        "total_lines": 3, "records": [], "parsed_records": 0, "output_records": 0
+    }
+
+
+@pytest.mark.parametrize("with_iocs", [False, True])
+def test_parse_lines_process_pool_matches_in_process(monkeypatch, with_iocs):
+    """
+    The process-pool branch (worker initializer included) must yield the
+    same records, in order, as parsing in-process.
+    """
+    lines = []
+    for i in range(20):
+        lines.append(f"<34>1 2025-05-26T14:00:{i:02d}Z host{i % 3} sshd - - - Failed password from 10.0.0.{i}")
+        if i % 7 == 0:
+            lines.append("not a syslog line")
+    ioc_index = None
+    if with_iocs:
+        ioc_index = enrichment_module.build_ioc_index(
+            [{"ioc": "10.0.0.7", "type": "ip", "description": "Known bad"}]
+        )
+
+    expected = list(cli_module.parse_lines(lines, ioc_index))
+
+    pools = []
+
+    class RecordingPool(cli_module.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(cli_module, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(cli_module, "PARALLEL_PARSE_MIN_LINES", 5)
+    monkeypatch.setattr(cli_module, "PARSE_CHUNKSIZE", 4)
+    pooled = list(cli_module.parse_lines(lines, ioc_index))
+
+    assert len(pools) == 1
+    assert pooled == expected
+    assert len(pooled) == 20
+    hits = [r for r in pooled if r.get("ioc_hits")]
+    assert len(hits) == (1 if with_iocs else 0)
+
+
+@pytest.mark.parametrize("flag, parent", [("--ai-batch", "--ai"), ("--geoip-batch", "--geoip")])
+def test_batch_flag_requires_parent_flag(tmp_path, monkeypatch, capsys, flag, parent):
+    sample = tmp_path / "sample.log"
+    sample.write_text("<34>1 2025-05-26T14:00:00Z host1 sshd - - - User login succeeded\n")
+    monkeypatch.setattr(sys, "argv", ["cli.py", "--file", str(sample), flag])
+    with pytest.raises(SystemExit) as exc:
+        main()
+    assert exc.value.code == 2
+    assert f"{flag} requires {parent}" in capsys.readouterr().err
@@ -4,13 +4,18 @@ import os
 import tempfile
 import csv
 import pytest
+import requests
 
 from blue_team_ai.enrichment import (
     load_ioc_list,
     extract_ip,
     lookup_geoip,
+    lookup_geoip_cached,
+    lookup_geoip_batch,
     enrich_record,
     enrich_all,
+    build_ioc_index,
+    extract_urls,
 )
 
 # 1. Test extract_ip (regex-based)
@@ -117,3 +122,121 @@ def test_enrich_record_and_enrich_all(monkeypatch, tmp_path):
     assert enriched_list[1]["ioc_hits"] == []
     assert "geoip" in enriched_list[1]
     assert enriched_list[1]["geoip"] == {}
+
+# 5. Test that repeated IPs are looked up once per cache
+def test_lookup_geoip_cached(monkeypatch):
+    calls = []
+
+    def dummy_lookup(ip):
+        calls.append(ip)
+        return {"country": "ZZ", "city": "Nowhere"} if ip == "8.8.8.8" else {}
+
+    monkeypatch.setattr("blue_team_ai.enrichment.lookup_geoip", dummy_lookup)
+
+    cache = {}
+    for _ in range(3):
+        assert lookup_geoip_cached("8.8.8.8", cache) == {"country": "ZZ", "city": "Nowhere"}
+        assert lookup_geoip_cached("10.0.0.1", cache) == {}
+    assert calls == ["8.8.8.8", "10.0.0.1"]
+
+    # Each call returns its own dict
+    lookup_geoip_cached("8.8.8.8", cache)["city"] = "Changed"
+    assert lookup_geoip_cached("8.8.8.8", cache)["city"] == "Nowhere"
+
+# 6. Test lookup_geoip_batch (monkeypatch the batch POST)
+def test_lookup_geoip_batch(monkeypatch):
+    import blue_team_ai.enrichment as enrichment_module
+    posts = []
+
+    class DummyResp:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return self.rows
+
+    def dummy_post(url, json, timeout):
+        posts.append([q["query"] for q in json])
+        return DummyResp([
+            {"status": "success", "countryCode": "ZZ", "city": "Testville", "query": q["query"]}
+            if q["query"] != "10.0.0.1" else {"status": "fail", "query": q["query"]}
+            for q in json
+        ])
+
+    monkeypatch.setattr(enrichment_module._SESSION, "post", dummy_post)
+    monkeypatch.setattr(enrichment_module, "GEOIP_BATCH_SIZE", 2)
+
+    geo = lookup_geoip_batch(["8.8.8.8", "10.0.0.1", "8.8.8.8", "", "1.1.1.1"])
+    assert posts == [["8.8.8.8", "10.0.0.1"], ["1.1.1.1"]]
+    assert geo == {
+        "8.8.8.8": {"country": "ZZ", "city": "Testville"},
+        "10.0.0.1": {},
+        "1.1.1.1": {"country": "ZZ", "city": "Testville"},
+    }
+
+# 6b. A malformed or error reply from the batch endpoint yields no results
+@pytest.mark.parametrize("status_code, rows, expected", [
+    (200, {"status": "fail", "message": "too many requests"}, {}),
+    (200, None, {}),
+    (200, ["oops", None, {"status": "success", "countryCode": "ZZ"},
+           {"status": "success", "countryCode": "ZZ", "city": "Testville", "query": "8.8.8.8"}],
+     {"8.8.8.8": {"country": "ZZ", "city": "Testville"}}),
+    (429, [{"status": "success", "countryCode": "ZZ", "city": "Testville", "query": "8.8.8.8"}], {}),
+])
+def test_lookup_geoip_batch_malformed_reply(monkeypatch, status_code, rows, expected):
+    import blue_team_ai.enrichment as enrichment_module
+
+    class DummyResp:
+        def raise_for_status(self):
+            if status_code >= 400:
+                raise requests.HTTPError(f"{status_code} error")
+
+        def json(self):
+            return rows
+
+    monkeypatch.setattr(enrichment_module._SESSION, "post", lambda url, json, timeout: DummyResp())
+
+    assert lookup_geoip_batch(["8.8.8.8", "1.1.1.1"]) == expected
+
+# 7. Test build_ioc_index and reusing it in enrich_all
+def test_build_ioc_index():
+    ioc_list = [
+        {"ioc": "Evil.com", "type": "Domain", "description": "First"},
+        {"ioc": "evil.com", "type": "domain", "description": "Duplicate"},
+        {"ioc": "1.2.3.4", "type": "ip", "description": "Test IP IOC"},
+        {"ioc": "whatever", "type": "unknown", "description": "Ignored type"},
+    ]
+    index = build_ioc_index(ioc_list)
+    assert index.entries is ioc_list
+    assert index.by_type_lower["domain"]["evil.com"]["description"] == "First"
+    assert set(index.by_type_lower["ip"]) == {"1.2.3.4"}
+
+    enriched = enrich_all([{"message": "from 1.2.3.4 to EVIL.com"}], index)
+    assert [hit["description"] for hit in enriched[0]["ioc_hits"]] == ["Test IP IOC", "First"]
+
+# 8. Test enrich_record(inplace=True) updates the record itself
+def test_enrich_record_inplace():
+    ioc_list = [{"ioc": "1.2.3.4", "type": "ip", "description": "Test IP IOC"}]
+    record = {"host": "myhost", "message": "User connected from 1.2.3.4"}
+
+    copied = enrich_record(record, ioc_list)
+    assert copied is not record and "ioc_hits" not in record
+
+    enriched = enrich_record(record, ioc_list, inplace=True)
+    assert enriched is record
+    assert record["src_ip"] == "1.2.3.4"
+    assert [hit["ioc"] for hit in record["ioc_hits"]] == ["1.2.3.4"]
+
+# 9. A URL ends at Unicode whitespace such as NBSP or U+3000
+@pytest.mark.parametrize("sep", ["\xa0", "\u3000", "\u2003"])
+def test_url_ioc_followed_by_unicode_space(sep):
+    url = "https://phish.example.net/login"
+    message = f"User clicked {url}{sep}now"
+    assert extract_urls(message) == [url]
+
+    ioc_list = [{"ioc": url, "type": "url", "description": "Phishing page"}]
+    enriched = enrich_all([{"message": message}], build_ioc_index(ioc_list))
+    assert [hit["ioc"] for hit in enriched[0]["ioc_hits"]] == [url]
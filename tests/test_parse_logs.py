@@ -3,9 +3,15 @@
 tests/test_parse_logs.py — Validate parse_syslog against RFC5424 lines.
 """
 
+import functools
+import io
+import json
+import sys
+
 import pytest
 from pathlib import Path
-from blue_team_ai.parsers.parse_logs import parse_syslog
+import blue_team_ai.parsers.parse_logs as parse_logs_module
+from blue_team_ai.parsers.parse_logs import iter_line_batches, main, parse_syslog
 from blue_team_ai.exceptions.unsupported_format import UnsupportedFormat
 
 
@@ -39,8 +45,8 @@ for path in possible_paths:
 else:
     pytest.exit("sample_syslog.log not found in expected data directories")
 
-with open(sample_file, "r") as f:
-    SAMPLE_LINES = [line.strip() for line in f if line.strip()]
+# One read and a C-level split rather than iterating the file line by line
+SAMPLE_LINES = [s for s in (line.strip() for line in sample_file.read_text().splitlines()) if s]
 
 
 def test_parse_basic_record():
@@ -117,3 +123,79 @@ def test_malformed_lines_raise(line):
 def test_all_sample_lines_parse():
     for line in SAMPLE_LINES:
         parse_syslog(line)  # should not raise
+
+
+def test_parse_multiple_structured_data_elements():
+    log = '<34>1 2025-05-15T14:31:02Z host1 sshd 1001 ID1 [a x="1"][b y="q\\]z"] Login ok'
+    record = parse_syslog(log)
+    assert record["structured_data"] == '[a x="1"][b y="q\\]z"]'
+    assert record["message"] == "Login ok"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", []),
+    ("one\ntwo\n", ["one", "two"]),
+    ("one\ntwo", ["one", "two"]),               # final line without a newline
+    ("a longer first line\nb\n", ["a longer first line", "b"]),  # split across chunks
+    ("\n\nx\n", ["", "", "x"]),
+])
+def test_iter_line_batches(text, expected):
+    batches = list(iter_line_batches(io.StringIO(text), chunk_size=4))
+    assert [line for batch in batches for line in batch] == expected
+
+
+def run_parse_logs_main(monkeypatch, tmp_path, lines, *extra_args):
+    """
+    Run parse_logs.main() on `lines` with small read chunks, writing to a
+    file. Returns (exit code or None, parsed output records).
+    """
+    log_file = tmp_path / "in.log"
+    log_file.write_text("\n".join(lines) + "\n")
+    out_file = tmp_path / "out.jsonl"
+    monkeypatch.setattr(sys, "argv", ["parse_logs.py", "-f", str(log_file), "-o", str(out_file), *extra_args])
+    monkeypatch.setattr(parse_logs_module, "iter_line_batches",
+                        functools.partial(iter_line_batches, chunk_size=64))
+    code = None
+    try:
+        main()
+    except SystemExit as e:
+        code = e.code
+    return code, [json.loads(line) for line in out_file.read_text().splitlines()]
+
+
+def test_main_writes_one_record_per_line(monkeypatch, tmp_path):
+    code, records = run_parse_logs_main(monkeypatch, tmp_path, SAMPLE_LINES)
+    assert code is None
+    assert records == [parse_syslog(line) for line in SAMPLE_LINES]
+
+
+def test_main_stops_at_first_malformed_line(monkeypatch, tmp_path, capsys):
+    lines = SAMPLE_LINES[:3] + ["garbage"] + SAMPLE_LINES[3:5]
+    code, records = run_parse_logs_main(monkeypatch, tmp_path, lines)
+    assert code == 1
+    # Records parsed before the bad line are still written
+    assert records == [parse_syslog(line) for line in SAMPLE_LINES[:3]]
+    assert "Error:" in capsys.readouterr().err
+
+
+def test_main_ignore_errors_skips_malformed_lines(monkeypatch, tmp_path, capsys):
+    lines = SAMPLE_LINES[:3] + ["garbage"] + SAMPLE_LINES[3:5]
+    code, records = run_parse_logs_main(monkeypatch, tmp_path, lines, "--ignore-errors")
+    assert code is None
+    assert records == [parse_syslog(line) for line in SAMPLE_LINES[:5]]
+    assert capsys.readouterr().err.count("Warning:") == 1
+
+
+def test_main_writes_to_stdout(monkeypatch, tmp_path, capsys):
+    log_file = tmp_path / "in.log"
+    log_file.write_text(SAMPLE_LINES[0])  # no trailing newline
+    monkeypatch.setattr(sys, "argv", ["parse_logs.py", "-f", str(log_file)])
+    main()
+    assert json.loads(capsys.readouterr().out) == parse_syslog(SAMPLE_LINES[0])
+
+
+def test_main_missing_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["parse_logs.py", "-f", str(tmp_path / "missing.log")])
+    with pytest.raises(SystemExit) as exc:
+        main()
+    assert exc.value.code == 1
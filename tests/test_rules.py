@@ -4,6 +4,7 @@ tests/test_rules.py — Unit tests for the rule engine.
 """
 import pytest
 from datetime import datetime, timedelta
+from functools import lru_cache
 from blue_team_ai.rules import (
     detect_ssh_bruteforce,
     detect_suspicious_cron,
@@ -12,6 +13,7 @@ from blue_team_ai.rules import (
 )
 
 
+@lru_cache(maxsize=None)
 def iso(ts):
     """Helper to get ISO timestamp without timezone Z suffix."""
     return ts.isoformat()
@@ -53,6 +55,21 @@ def test_detect_ssh_bruteforce_no_trigger():
     assert alerts == []
 
 
+def test_detect_ssh_bruteforce_late_burst():
+    # Sparse failures followed by a burst; only the burst fills a window
+    base = datetime(2025, 5, 20, 12, 0, 0)
+    offsets = [0, 100, 200] + [300 + i for i in range(6)]
+    records = [
+        {"appname": "sshd", "host": "h1", "message": "Failed password",
+         "timestamp": iso(base + timedelta(seconds=off))}
+        for off in offsets
+    ]
+    alerts = detect_ssh_bruteforce(records)
+    assert len(alerts) == 1
+    assert alerts[0]["count"] == 6
+    assert alerts[0]["first_seen"] == iso(base + timedelta(seconds=300))
+
+
 def test_detect_suspicious_cron():
     # Cron run by non-root user
     rec1 = {"appname": "cron", "host": "srv", "message": "(admin) run job", "timestamp": "2025-05-20T12:00:00"}